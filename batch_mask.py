@@ -0,0 +1,339 @@
+"""
+Batch entry point for masking a corpus: reads JSONL, a directory of text files or stdin, and streams masked JSONL out.
+
+Examples:
+    python batch_mask.py tickets.jsonl -o masked.jsonl --workers 16
+    python batch_mask.py ./contracts -o masked.jsonl --checkpoint masked.ckpt
+    cat tickets.jsonl | python batch_mask.py - --engine local > masked.jsonl
+    python batch_mask.py tickets.jsonl -o masked.jsonl --cascade 'GPT 3.5' 'GPT 4'
+
+Output records are appended. Failed documents are not checkpointed, so a resumed run retries them and the
+output can hold an error record followed by a masked record for the same id; keep the last record per id.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+from mask_utils import mask_text
+from metrics import metrics
+
+# A document is (id, text), or (id, error) for an input record that could not be read
+Document = Tuple[str, Union[str, Exception]]
+
+# HTTP status codes worth retrying: timeouts, conflicts, rate limits and server errors
+transient_status_codes = {408, 409, 429, 500, 502, 503, 504}
+
+
+def read_jsonl(lines: Iterable[str], id_field: str = "id", text_field: str = "text") -> Iterator[Document]:
+    """
+    Reads documents from JSON lines, numbering lines without an id.
+
+    Lines that are not JSON objects with a string text field are yielded with the error instead of the text,
+    so one bad record does not stop the run.
+
+    Args:
+        lines (Iterable[str]): The JSON lines.
+        id_field (str): The name of the id field.
+        text_field (str): The name of the text field.
+
+    Yields:
+        Document: The (id, text) of each line, or (id, error) for unreadable lines.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        doc_id = str(line_number)
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"line {line_number} is not a JSON object")
+            doc_id = str(record.get(id_field, line_number))
+            if not isinstance(record.get(text_field), str):
+                raise ValueError(f"line {line_number} has no string '{text_field}' field")
+        except ValueError as e:
+            yield doc_id, e
+            continue
+        yield doc_id, record[text_field]
+
+
+def read_directory(path: str, suffixes: Tuple[str, ...] = (".txt",)) -> Iterator[Document]:
+    """
+    Reads documents from the text files under a directory, using the relative path as id.
+
+    Files that cannot be read as UTF-8 are yielded with the error instead of the text, so one bad file does not
+    stop the run.
+
+    Args:
+        path (str): The directory to walk.
+        suffixes (Tuple[str, ...]): The file suffixes to read.
+
+    Yields:
+        Document: The (id, text) of each file, or (id, error) for unreadable files.
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(suffixes):
+                file_path = os.path.join(root, name)
+                try:
+                    with open(file_path, encoding="utf-8") as f:
+                        text = f.read()
+                except (OSError, UnicodeDecodeError) as e:
+                    yield os.path.relpath(file_path, path), e
+                    continue
+                yield os.path.relpath(file_path, path), text
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Checks whether an exception from the LLM client signals rate limiting.
+
+    Args:
+        error (Exception): The exception raised while tagging.
+
+    Returns:
+        bool: True for HTTP 429 responses and RateLimitError exceptions.
+    """
+    return getattr(error, "status_code", None) == 429 or "RateLimit" in type(error).__name__
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Reads the Retry-After header from a rate limit response, if any.
+
+    Args:
+        error (Exception): The exception raised while tagging.
+
+    Returns:
+        Optional[float]: The number of seconds to wait, or None if unknown.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Checks whether an exception is worth retrying: rate limits, timeouts, connection and server errors.
+
+    Args:
+        error (Exception): The exception raised while tagging.
+
+    Returns:
+        bool: False for deterministic failures such as parse errors, which fail the same way on every retry.
+    """
+    if is_rate_limit_error(error) or getattr(error, "status_code", None) in transient_status_codes:
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(name in type(error).__name__ for name in ("Timeout", "Connection", "InternalServer", "ServiceUnavailable"))
+
+
+def with_retries(func: Callable, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0) -> Callable:
+    """
+    Wraps func to retry transient failures with exponential backoff and jitter, waiting longer when rate limited.
+    Other exceptions are raised immediately.
+
+    Args:
+        func (Callable): The function to call.
+        max_retries (int): The maximum number of retries.
+        base_delay (float): The delay before the first retry, in seconds.
+        max_delay (float): The maximum delay between retries, in seconds.
+
+    Returns:
+        Callable: The wrapped function.
+    """
+    def wrapper(*args, **kwargs):
+        for attempt in range(max_retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == max_retries or not is_transient_error(e):
+                    raise
+                metrics.increment("pii_retries_total", rate_limited=is_rate_limit_error(e))
+                delay = min(max_delay, base_delay * 2 ** attempt)
+                if is_rate_limit_error(e):
+                    delay = retry_after(e) or min(max_delay, delay * 2)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+    return wrapper
+
+
+def load_checkpoint(path: Optional[str]) -> Set[str]:
+    """
+    Reads the ids of documents completed by a previous run.
+
+    Args:
+        path (Optional[str]): The checkpoint file, one id per line.
+
+    Returns:
+        Set[str]: The completed ids.
+    """
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def mask_document(tagger, document: Document, model_choice: str, include_tagged_text: bool = False,
+                  **options) -> Dict:
+    """
+    Tags and masks a single document, masking every tagged value.
+
+    Args:
+        tagger (PIITagger): The tagger to use.
+        document (Document): The (id, text) to mask.
+        model_choice (str): The name of the selected model.
+        include_tagged_text (bool): Whether to add the tagged text, which holds the original PII, to the result.
+        **options: Options passed on to PIITagger.tag_pii_elements_chunked.
+
+    Returns:
+        Dict: The id and masked text, and the tagged text if requested.
+
+    Raises:
+        ValueError: If validation defects remain after repair, as the tagging may have missed PII.
+    """
+    doc_id, text = document
+    response = tagger.tag_pii_elements_chunked(model_choice, text, **options)
+    if response["defects"]:
+        raise ValueError(f"{len(response['defects'])} validation defects remain after repair: "
+                         + "; ".join(defect.code for defect in response["defects"]))
+    tagged_text = response["transformed_data"].tagged_text
+    masked_text, _, _ = mask_text(tagged_text)
+    result = {"id": doc_id, "masked_text": masked_text}
+    if include_tagged_text:
+        result["tagged_text"] = tagged_text
+    return result
+
+
+def mask_documents(documents: Iterable[Document], model_choice: str = "GPT 3.5", max_workers: int = 8,
+                   max_retries: int = 5, completed: Optional[Set[str]] = None, tagger=None, **options) -> Iterator[Dict]:
+    """
+    Masks documents concurrently, yielding results as they complete.
+
+    At most 2 * max_workers documents are read ahead, so inputs of any size stream in constant memory.
+    Documents that could not be read, still fail after retrying transient errors, or keep validation defects
+    after repair are yielded with an 'error' field.
+
+    Args:
+        documents (Iterable[Document]): The (id, text) pairs to mask.
+        model_choice (str): The name of the selected model.
+        max_workers (int): The maximum number of documents tagged concurrently.
+        max_retries (int): The maximum number of retries per document.
+        completed (Optional[Set[str]]): Ids to skip, e.g. from a checkpoint.
+        tagger (PIITagger): The tagger to use; defaults to the shared tagger.
+        **options: Options passed on to mask_document, such as include_tagged_text, and on to
+            PIITagger.tag_pii_elements_chunked.
+
+    Yields:
+        Dict: One result per document, in completion order.
+    """
+    if tagger is None:
+        from masking_agent import get_tagger
+        tagger = get_tagger()
+    completed = completed or set()
+    task = with_retries(mask_document, max_retries=max_retries)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for document in documents:
+            if document[0] in completed:
+                continue
+            if isinstance(document[1], Exception):
+                yield {"id": document[0], "error": f"{type(document[1]).__name__}: {document[1]}"}
+                continue
+            pending[executor.submit(task, tagger, document, model_choice, **options)] = document[0]
+            if len(pending) >= 2 * max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _results(done, pending)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _results(done, pending)
+
+
+def _results(done, pending: Dict) -> Iterator[Dict]:
+    """
+    Yields the results of completed futures and removes them from pending.
+
+    Args:
+        done (Set[Future]): The completed futures.
+        pending (Dict[Future, str]): The in-flight futures mapped to document ids.
+
+    Yields:
+        Dict: The result of each future, or the id and error if it failed.
+    """
+    for future in done:
+        doc_id = pending.pop(future)
+        try:
+            yield future.result()
+        except Exception as e:
+            yield {"id": doc_id, "error": f"{type(e).__name__}: {e}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file, directory of .txt files, or '-' for JSONL on stdin")
+    parser.add_argument("-o", "--output", help="output JSONL file, appended to when resuming, so keep the last "
+                                               "record per id (default: stdout)")
+    parser.add_argument("--checkpoint", help="file recording completed ids, used to resume an interrupted run")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--model", default="GPT 3.5", help="model choice, e.g. 'GPT 3.5' or 'GPT 4'")
+    parser.add_argument("--cascade", nargs="+", metavar="MODEL",
+                        help="model choices to try cheapest first, escalating chunks that fail validation, "
+                             "e.g. --cascade 'GPT 3.5' 'GPT 4'")
+    parser.add_argument("--workers", type=int, default=8, help="maximum number of documents in flight")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--engine", default="llm", choices=["llm", "local", "local_verify"])
+    parser.add_argument("--rules", default="off", choices=["off", "prepass", "only"])
+    parser.add_argument("--output-mode", default="tagged", choices=["tagged", "spans"])
+    parser.add_argument("--reflection", default="on_failure", choices=["always", "never", "on_failure"])
+    parser.add_argument("--include-tagged-text", action="store_true",
+                        help="also write the tagged text, which contains the original PII")
+    parser.add_argument("--metrics-file", help="file the run's metrics are written to in the Prometheus text format")
+    args = parser.parse_args()
+
+    if args.input == "-":
+        documents = read_jsonl(sys.stdin, args.id_field, args.text_field)
+    elif os.path.isdir(args.input):
+        documents = read_directory(args.input)
+    else:
+        documents = read_jsonl(open(args.input, encoding="utf-8"), args.id_field, args.text_field)
+
+    completed = load_checkpoint(args.checkpoint)
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    checkpoint = open(args.checkpoint, "a", encoding="utf-8") if args.checkpoint else None
+    counts = {"masked": 0, "failed": 0, "skipped": len(completed)}
+    results = mask_documents(
+        documents, model_choice=args.model, max_workers=args.workers, max_retries=args.max_retries,
+        completed=completed, engine=args.engine, rules_mode=args.rules, output_mode=args.output_mode,
+        reflection_mode=args.reflection, models=args.cascade, include_tagged_text=args.include_tagged_text
+    )
+    for result in results:
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+        if "error" in result:
+            counts["failed"] += 1
+            continue
+        counts["masked"] += 1
+        if checkpoint:
+            # ids are checkpointed only after their output is flushed, so a resumed run never loses a document
+            checkpoint.write(result["id"] + "\n")
+            checkpoint.flush()
+    print(f"masked: {counts['masked']}, failed: {counts['failed']}, skipped: {counts['skipped']}", file=sys.stderr)
+    if args.cascade:
+        from masking_agent import escalation_rates
+        for model_choice, rate in escalation_rates(args.cascade).items():
+            print(f"escalated from {model_choice}: {rate:.1%}", file=sys.stderr)
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
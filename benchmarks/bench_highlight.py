@@ -0,0 +1,79 @@
+"""
+Micro-benchmark comparing highlight_text with the previous one-regex-per-tag implementation.
+
+Run from the repository root:
+    python benchmarks/bench_highlight.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mask_utils import color_map, highlight_text
+
+
+def highlight_text_per_tag(tagged_text: str) -> str:
+    """
+    The previous implementation: compiles and applies one regex per entry in color_map.
+
+    Args:
+        tagged_text (str): The input text with tagged entities.
+
+    Returns:
+        str: The input text with tags replaced with colors for entities.
+    """
+    for tag, color in color_map.items():
+        pattern = re.compile(f'<{tag}>(.*?)</{tag}>')
+        tagged_text = pattern.sub(f'<span style="color:{color}">**\\1**</span>', tagged_text)
+    return tagged_text
+
+
+def make_tagged_text(size: int, density: float, malformed: float, seed: int = 0) -> str:
+    """
+    Generates synthetic tagged text of roughly the given size.
+
+    Args:
+        size (int): The approximate number of characters.
+        density (float): The fraction of words that are tagged.
+        malformed (float): The fraction of tagged words whose closing tag is missing.
+        seed (int): The random seed.
+
+    Returns:
+        str: The synthetic tagged text.
+    """
+    rng = random.Random(seed)
+    tags = list(color_map)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'John', 'Ohio', 'CVS'])
+        if rng.random() < density:
+            tag = rng.choice(tags)
+            word = f'<{tag}>{word}' if rng.random() < malformed else f'<{tag}>{word}</{tag}>'
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--density", type=float, default=0.2)
+    parser.add_argument("--malformed", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'per-tag (ms)':>14} {'single (ms)':>14} {'speedup':>8}")
+    for size in args.sizes:
+        text = make_tagged_text(size, args.density, args.malformed)
+        per_tag = min(timeit.repeat(lambda: highlight_text_per_tag(text), number=1, repeat=args.repeat))
+        single = min(timeit.repeat(lambda: highlight_text(text), number=1, repeat=args.repeat))
+        print(f"{size:>10} {per_tag * 1000:>14.2f} {single * 1000:>14.2f} {per_tag / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Benchmarks the tagging graph, highlight_text and mask_text on synthetic corpora, offline.
+
+The graph runs against FakeChatModel, so no network or API key is needed. Results are written as JSON
+keyed by commit, so runs can be compared between commits.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --sizes 500 2000 8000 --densities 2 10 -o bench.json
+    python benchmarks/bench_pipeline.py --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from faker import Faker
+from mask_utils import highlight_text, mask_text
+from pseudonym import Pseudonymizer
+from span_utils import locate_values, render_tagged_text
+
+
+def make_corpus(docs: int, size: int, density: float, seed: int = 0) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Generates synthetic documents with a known set of PII values.
+
+    Args:
+        docs (int): The number of documents.
+        size (int): The approximate number of characters per document.
+        density (float): The number of PII values per 100 words.
+        seed (int): The random seed.
+
+    Returns:
+        Tuple[List[str], Dict[str, str]]: The documents, and a mapping of PII values to entity types.
+    """
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    generators = {
+        'first_name': fake.first_name, 'last_name': fake.last_name, 'email': fake.safe_email,
+        'phone': lambda: fake.numerify('(###) ###-####'), 'address_line_1': fake.street_address,
+        'city': fake.city, 'company': fake.company,
+    }
+    filler = "the a report was filed regarding account review on with and for after meeting noted".split()
+    known: Dict[str, str] = {}
+    corpus = []
+    for _ in range(docs):
+        words, length = [], 0
+        while length < size:
+            if rng.random() < density / 100:
+                entity = rng.choice(list(generators))
+                word = generators[entity]()
+                known[word] = entity
+            else:
+                word = rng.choice(filler)
+            words.append(word)
+            length += len(word) + 1
+        corpus.append(" ".join(words) + ".")
+    return corpus, known
+
+
+def measure(func: Callable[[str], object], inputs: List[str]) -> Dict[str, float]:
+    """
+    Times func on every input, then measures its peak memory on the first input.
+
+    Args:
+        func (Callable[[str], object]): The function to benchmark.
+        inputs (List[str]): The inputs.
+
+    Returns:
+        Dict[str, float]: docs/sec, p50 and p95 latency in milliseconds, and peak memory in KiB.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for item in inputs:
+        t = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    tracemalloc.start()
+    func(inputs[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "docs_per_sec": len(inputs) / total,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def git_commit() -> str:
+    """
+    Returns the current commit hash, or 'unknown' outside a git checkout.
+
+    Returns:
+        str: The commit hash.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> Dict:
+    """
+    Runs every stage on every corpus.
+
+    Args:
+        args (argparse.Namespace): The parsed command line.
+
+    Returns:
+        Dict: The run metadata and results.
+    """
+    tagger = None
+    if not args.skip_graph:
+        from fake_llm import FakeChatModel, scripted_responder
+        from masking_agent import PIITagger, register_model
+        tagger = PIITagger(cache=None)
+    results = []
+    for size in args.sizes:
+        for density in args.densities:
+            corpus, known = make_corpus(args.docs, size, density, seed=args.seed)
+            pairs = [(tag, value) for value, tag in known.items()]
+            tagged = [render_tagged_text(text, locate_values(text, pairs)) for text in corpus]
+            pseudonymizer = Pseudonymizer(key=b"benchmark")
+            stages = {
+                "highlight_text": (highlight_text, tagged),
+                "mask_text": (lambda text: mask_text(text, pseudonymizer=pseudonymizer), tagged),
+            }
+            if tagger is not None:
+                register_model("Fake", FakeChatModel(responder=scripted_responder(known), latency=args.latency,
+                                                     token_latency=args.token_latency))
+                stages["graph"] = (lambda text: tagger.tag_pii_elements(
+                    "Fake", text, output_mode=args.output_mode, reflection_mode=args.reflection), corpus)
+            for stage, (func, inputs) in stages.items():
+                row = {"stage": stage, "size": size, "density": density, **measure(func, inputs)}
+                results.append(row)
+                print(f"{stage:>15} {size:>7} {density:>5} {row['docs_per_sec']:>10.1f} {row['p50_ms']:>9.2f} "
+                      f"{row['p95_ms']:>9.2f} {row['peak_kib']:>10.1f}")
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+
+
+def compare(previous: Dict, current: Dict) -> None:
+    """
+    Prints the change in throughput and latency between two runs.
+
+    Args:
+        previous (Dict): The earlier run.
+        current (Dict): The later run.
+    """
+    before = {(r["stage"], r["size"], r["density"]): r for r in previous["results"]}
+    print(f"\n{previous['commit']} -> {current['commit']}")
+    print(f"{'stage':>15} {'size':>7} {'dens':>5} {'docs/s':>9} {'p50':>9} {'p95':>9}")
+    for row in current["results"]:
+        old = before.get((row["stage"], row["size"], row["density"]))
+        if old is None:
+            continue
+        print(f"{row['stage']:>15} {row['size']:>7} {row['density']:>5} "
+              f"{row['docs_per_sec'] / old['docs_per_sec']:>8.2f}x "
+              f"{row['p50_ms'] / old['p50_ms']:>8.2f}x {row['p95_ms'] / old['p95_ms']:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 8000])
+    parser.add_argument("--densities", type=float, nargs="+", default=[2, 10])
+    parser.add_argument("--docs", type=int, default=50, help="documents per corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="simulated seconds per output token")
+    parser.add_argument("--output-mode", default="tagged", choices=["tagged", "spans"])
+    parser.add_argument("--reflection", default="on_failure", choices=["always", "never", "on_failure"])
+    parser.add_argument("--skip-graph", action="store_true", help="only benchmark highlight_text and mask_text")
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    print(f"{'stage':>15} {'size':>7} {'dens':>5} {'docs/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'peak KiB':>10}")
+    current = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), current)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+A deterministic, offline chat model for benchmarking the tagging graph without OpenAI.
+"""
+
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rules import detect_entities
+from span_utils import identifiers_from_spans, locate_values, overlay_spans, render_tagged_text
+
+# Captures the document from the tagging prompts, which end the text with blank lines before the format instructions
+_text_pattern = re.compile(r'TEXT:\n {8}(.*?)\n\s*\n\s*Format your output using the format instructions', re.DOTALL)
+# Captures the id and text of every document in the packed prompt
+_packed_pattern = re.compile(r'^ *--- BEGIN TEXT (\d+) ---\n(.*?)\n--- END TEXT \1 ---$', re.DOTALL | re.MULTILINE)
+
+
+def scripted_responder(known_values: Optional[Dict[str, str]] = None) -> Callable[[List[BaseMessage]], str]:
+    """
+    Builds a responder that tags the prompted text with the local rules plus a dictionary of known values.
+
+    Args:
+        known_values (Optional[Dict[str, str]]): Maps values to the entity type they should be tagged as.
+
+    Returns:
+        Callable[[List[BaseMessage]], str]: Maps the prompt messages to the JSON response.
+    """
+    pairs = [(tag, value) for value, tag in (known_values or {}).items()]
+
+    def respond(messages: List[BaseMessage]) -> str:
+        if "Review TransformedData" in messages[-1].content:
+            return json.dumps({"review": "Matches the requirements.", "recommendations": "None.", "feedback": "perfect"})
+        prompt = messages[1].content
+        if "TEXTS:" in prompt:
+            items = []
+            for id, text in _packed_pattern.findall(prompt):
+                spans = overlay_spans(detect_entities(text), locate_values(text, pairs))
+                items.append({"id": id, "identifiers": identifiers_from_spans(text, spans),
+                              "tagged_text": render_tagged_text(text, spans)})
+            return json.dumps({"items": items})
+        match = _text_pattern.search(prompt)
+        text = match.group(1) if match else ""
+        spans = overlay_spans(detect_entities(text), locate_values(text, pairs))
+        if "Do not repeat TEXT" in prompt:
+            return json.dumps({"entities": [{"type": tag, "value": text[start:end]} for start, end, tag in spans]})
+        return json.dumps({
+            "identifiers": identifiers_from_spans(text, spans),
+            "tagged_text": render_tagged_text(text, spans)
+        })
+    return respond
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model returning scripted responses after a simulated latency.
+    """
+    responder: Callable[[List[BaseMessage]], str]
+    latency: float = 0.0
+    token_latency: float = 0.0
+    chunk_chars: int = 16
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-pii-tagger"
+
+    def _delay(self, content: str) -> float:
+        # roughly four characters per output token
+        return self.latency + self.token_latency * len(content) / 4
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs) -> ChatResult:
+        content = self.responder(messages)
+        time.sleep(self._delay(content))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                         **kwargs) -> ChatResult:
+        content = self.responder(messages)
+        await asyncio.sleep(self._delay(content))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs) -> Iterator[ChatGenerationChunk]:
+        content = self.responder(messages)
+        time.sleep(self.latency)
+        for i in range(0, len(content), self.chunk_chars):
+            piece = content[i:i + self.chunk_chars]
+            time.sleep(self.token_latency * len(piece) / 4)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                       **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        content = self.responder(messages)
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(content), self.chunk_chars):
+            piece = content[i:i + self.chunk_chars]
+            await asyncio.sleep(self.token_latency * len(piece) / 4)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
@@ -0,0 +1,169 @@
+"""
+This module contains a content-addressed cache for tagging results, with an in-memory LRU tier and an optional SQLite tier.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+import prompts
+from entities import TransformedData, ExtractedEntities, PackedOutput
+
+
+def _prompt_version() -> str:
+    """
+    Hashes every prompt template and output schema, so editing either invalidates cached results.
+
+    Returns:
+        str: The hex digest identifying the current prompts and schemas.
+    """
+    templates = {name: value for name, value in vars(prompts).items()
+                 if not name.startswith('_') and isinstance(value, (str, list, dict))}
+    payload = json.dumps(templates, sort_keys=True, default=str)
+    payload += TransformedData.schema_json() + ExtractedEntities.schema_json() + PackedOutput.schema_json()
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+prompt_version = _prompt_version()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text so trivially different copies of a document share a cache entry.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The NFC-normalized text with unified line endings and surrounding whitespace removed.
+    """
+    return unicodedata.normalize('NFC', text).replace('\r\n', '\n').strip()
+
+
+def cache_key(text: str, model_choice: str, **options) -> str:
+    """
+    Builds the cache key for a text and the options it was tagged with.
+
+    Args:
+        text (str): The text being tagged.
+        model_choice (str): The name of the selected model.
+        **options: Any other options that change the result, such as output_mode.
+
+    Returns:
+        str: The hex digest of the normalized text, model choice, options and prompt version.
+    """
+    payload = json.dumps([normalize_text(text), model_choice, options, prompt_version], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Creates the cache.
+
+        Args:
+            max_entries (int): The maximum number of results kept in memory.
+            path (Optional[str]): The SQLite file for the on-disk tier, or None for memory only.
+            max_bytes (int): The maximum total size of results kept on disk.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[TransformedData]:
+        """
+        Looks up a result, promoting disk hits to memory.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Optional[TransformedData]: The cached result, or None on a miss.
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return TransformedData.parse_raw(value)
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, row[0])
+                    self.counters["disk_hits"] += 1
+                    return TransformedData.parse_raw(row[0])
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, transformed_data: TransformedData) -> None:
+        """
+        Stores a result in memory and, if configured, on disk.
+
+        Args:
+            key (str): The cache key.
+            transformed_data (TransformedData): The result to store.
+        """
+        value = transformed_data.json()
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), time.time())
+                )
+                self._evict_disk()
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit, miss and eviction counters along with the number of entries in memory.
+
+        Returns:
+            Dict[str, int]: The cache statistics.
+        """
+        with self._lock:
+            return {**self.counters, "memory_entries": len(self._memory)}
+
+    def _remember(self, key: str, value: str) -> None:
+        """
+        Adds a serialized result to the memory tier, evicting the least recently used entries.
+
+        Args:
+            key (str): The cache key.
+            value (str): The serialized result.
+        """
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _evict_disk(self) -> None:
+        """
+        Deletes the least recently accessed results until the disk tier fits in max_bytes.
+        """
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM results ORDER BY accessed LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (row[0],))
+            total -= row[1]
+            self.counters["evictions"] += 1
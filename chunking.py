@@ -0,0 +1,82 @@
+"""
+This module splits long documents into overlapping chunks for parallel tagging.
+"""
+
+import re
+from typing import List, Tuple
+
+# Boundaries in order of preference: paragraphs, sentences, then any whitespace
+boundary_patterns = [
+    re.compile(r'\n\s*\n'),
+    re.compile(r'(?<=[.!?])\s+'),
+    re.compile(r'\s+'),
+]
+
+
+def _boundary_before(text: str, start: int, end: int) -> int:
+    """
+    Finds the last preferred boundary in text[start:end].
+
+    Args:
+        text (str): The text being split.
+        start (int): The earliest acceptable offset.
+        end (int): The latest acceptable offset.
+
+    Returns:
+        int: The offset just after the boundary, or end if there is none.
+    """
+    for pattern in boundary_patterns:
+        last = None
+        for match in pattern.finditer(text, start, end):
+            last = match
+        if last is not None and last.end() > start:
+            return last.end()
+    return end
+
+
+def _boundary_after(text: str, start: int, end: int) -> int:
+    """
+    Finds the first sentence or word boundary in text[start:end].
+
+    Args:
+        text (str): The text being split.
+        start (int): The earliest acceptable offset.
+        end (int): The offset the boundary must precede.
+
+    Returns:
+        int: The offset just after the boundary, or end if there is none.
+    """
+    for pattern in boundary_patterns[1:]:
+        match = pattern.search(text, start, end)
+        if match is not None and match.end() < end:
+            return match.end()
+    return end
+
+
+def split_text(text: str, max_chars: int = 4000, overlap: int = 200) -> List[Tuple[int, int]]:
+    """
+    Splits text into chunks of at most max_chars, ending on paragraph or sentence boundaries.
+
+    Consecutive chunks overlap by up to overlap characters, starting on a boundary,
+    so entities cut by one chunk boundary are seen whole by the neighbouring chunk.
+
+    Args:
+        text (str): The text to split.
+        max_chars (int): The maximum number of characters per chunk.
+        overlap (int): The number of characters shared by consecutive chunks.
+
+    Returns:
+        List[Tuple[int, int]]: The (start, end) offsets of each chunk.
+    """
+    if max_chars <= overlap:
+        raise ValueError(f"max_chars ({max_chars}) must be larger than overlap ({overlap})")
+    chunks: List[Tuple[int, int]] = []
+    start = 0
+    while start < len(text):
+        if len(text) - start <= max_chars:
+            chunks.append((start, len(text)))
+            break
+        end = _boundary_before(text, start + overlap + 1, start + max_chars)
+        chunks.append((start, end))
+        start = _boundary_after(text, max(start + 1, end - overlap), end)
+    return chunks
@@ -27,7 +27,45 @@ class TransformedData(BaseModel):
     tagged_text: Optional[str] = Field(description="The input text with PII elements tagged")
     
     
+class PackedTransformedData(TransformedData):
+    """
+    Structure to hold transformed data for one of several texts tagged in one request
+    """
+    id: str = Field(description="The ID of the text, as given in its BEGIN TEXT and END TEXT delimiters")
+
+
+class PackedOutput(BaseModel):
+    """
+    Structure to hold transformed data for several texts tagged in one request
+    """
+    items: List[PackedTransformedData] = Field(default_factory=list, description="One TransformedData per text, in the order of the texts")
+
+
+class Entity(BaseModel):
+    """
+    Structure to hold a single PII element found in text
+    """
+    type: str = Field(description="The type of the PII element, one of the Identifiers field names such as first_name or zipcode")
+    value: str = Field(description="The PII element exactly as it appears in the text")
+
+
+class ExtractedEntities(BaseModel):
+    """
+    Structure to hold the PII elements found in text, without echoing the text
+    """
+    entities: List[Entity] = Field(default_factory=list, description="List of PII elements identified in the text")
+
+
 class ReflectionOuput(BaseModel):
     review: str = Field(default="n/a", description="Review of the TransformedData as to how well it aligns with the expected format")
     recommendations: str = Field(default="n/a", description="Actionable recommendations formatted as a multiline string containing bulleted list of necessary changes to align with original formatting instructions and improvement if needed for any attribute. Use examples as needed. If the TransformedData matches all requirements say so.")
-    feedback: str = Field(default="n/a", description="'perfect' if no changes are required, or 'needs work' otherwise")
\ No newline at end of file
+    feedback: str = Field(default="n/a", description="'perfect' if no changes are required, or 'needs work' otherwise")
+
+class Defect(BaseModel):
+    """
+    Structure to hold a defect found by local validation of TransformedData
+    """
+    code: str = Field(description="Machine readable defect code, e.g. 'unknown_tag' or 'text_mismatch'")
+    tag: Optional[str] = Field(default=None, description="The tag or identifier field the defect refers to")
+    value: Optional[str] = Field(default=None, description="The value the defect refers to")
+    message: str = Field(description="Human readable description of the defect")
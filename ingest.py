@@ -0,0 +1,298 @@
+"""
+This module extracts text from PDF and DOCX files page by page or section by section, masks it, and writes
+the masked document back in its original structure.
+
+Example:
+    python ingest.py contract.pdf -o contract_masked.pdf --workers 8
+"""
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from mask_utils import mask_text
+from span_utils import Span, extract_spans, render_tagged_text
+
+# An extracted PDF page is (page number, text, words), with words as returned by page.get_text("words")
+PdfPage = Tuple[int, str, List[tuple]]
+
+
+def _pdf_page_texts(path: str, start: int, end: int, ocr: bool) -> List[PdfPage]:
+    """
+    Extracts the text and words of a range of PDF pages; runs in a worker process.
+
+    Args:
+        path (str): The PDF file.
+        start (int): The first page number.
+        end (int): The page number after the last page.
+        ocr (bool): Whether to OCR pages without a text layer, which needs Tesseract.
+
+    Returns:
+        List[PdfPage]: The page number, text and words of each page.
+    """
+    import fitz
+    pages = []
+    with fitz.open(path) as document:
+        for number, page in enumerate(document.pages(start, end), start=start):
+            textpage = page.get_textpage()
+            if ocr and not page.get_text(textpage=textpage).strip():
+                textpage = page.get_textpage_ocr(full=True)
+            pages.append((number, page.get_text(textpage=textpage), page.get_text("words", textpage=textpage)))
+    return pages
+
+
+def extract_pdf_pages(path: str, max_workers: Optional[int] = None, ocr: bool = True,
+                      pages_per_task: int = 4) -> Iterator[PdfPage]:
+    """
+    Extracts the text and words of every PDF page in a process pool, yielding pages as they are extracted.
+
+    Args:
+        path (str): The PDF file.
+        max_workers (Optional[int]): The number of worker processes; defaults to the number of CPUs.
+        ocr (bool): Whether to OCR pages without a text layer.
+        pages_per_task (int): The number of pages each worker extracts per task.
+
+    Yields:
+        PdfPage: The page number, text and words of each page, in completion order.
+    """
+    import fitz
+    with fitz.open(path) as document:
+        page_count = document.page_count
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    if len(ranges) <= 1:
+        yield from _pdf_page_texts(path, 0, page_count, ocr)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_pdf_page_texts, path, start, end, ocr) for start, end in ranges]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def word_rects(text: str, words: List[tuple], spans: List[Span]) -> List[List[tuple]]:
+    """
+    Finds the page areas of spans of a page's text, one rectangle per line the span covers.
+
+    Words are located in the text in order, and a span covering part of a word gets the proportional part
+    of the word's rectangle.
+
+    Args:
+        text (str): The page text.
+        words (List[tuple]): The page words as (x0, y0, x1, y1, word, block, line, word number).
+        spans (List[Span]): Spans of the page text.
+
+    Returns:
+        List[List[tuple]]: For each span, the (x0, y0, x1, y1) rectangles it covers.
+    """
+    offsets = []
+    cursor = 0
+    for word in words:
+        start = text.find(word[4], cursor)
+        if start == -1:
+            continue
+        cursor = start + len(word[4])
+        offsets.append((start, cursor, word))
+    rects = []
+    for start, end, _ in spans:
+        lines: Dict[Tuple[int, int], List[float]] = {}
+        for word_start, word_end, (x0, y0, x1, y1, _, block, line, _) in offsets:
+            if word_end <= start or word_start >= end:
+                continue
+            width = (x1 - x0) / (word_end - word_start)
+            left = x0 + width * max(0, start - word_start)
+            right = x1 - width * max(0, word_end - end)
+            rect = lines.setdefault((block, line), [left, y0, right, y1])
+            rect[:] = [min(rect[0], left), min(rect[1], y0), max(rect[2], right), max(rect[3], y1)]
+        rects.append([tuple(rect) for rect in lines.values()])
+    return rects
+
+
+def docx_paragraphs(document) -> List:
+    """
+    Lists the paragraphs of a DOCX document, including those in table cells, in document order.
+
+    A merged cell is returned by row.cells once per grid column it spans, so its paragraphs are listed once.
+
+    Args:
+        document (docx.Document): The opened document.
+
+    Returns:
+        List[docx.text.paragraph.Paragraph]: The paragraphs.
+    """
+    paragraphs = list(document.paragraphs)
+    seen = set()
+    for table in document.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                # holding the elements keeps lxml returning the same proxy, so identity is stable
+                if cell._tc in seen:
+                    continue
+                seen.add(cell._tc)
+                paragraphs.extend(cell.paragraphs)
+    return paragraphs
+
+
+def docx_sections(paragraphs: List, max_chars: int = 4000) -> List[List[int]]:
+    """
+    Groups paragraphs into sections starting at headings, capped at max_chars.
+
+    Args:
+        paragraphs (List[docx.text.paragraph.Paragraph]): The paragraphs.
+        max_chars (int): The maximum number of characters per section.
+
+    Returns:
+        List[List[int]]: The paragraph indexes of each section.
+    """
+    sections: List[List[int]] = []
+    size = 0
+    for i, paragraph in enumerate(paragraphs):
+        is_heading = paragraph.style is not None and paragraph.style.name.startswith("Heading")
+        if not sections or is_heading or size + len(paragraph.text) > max_chars:
+            sections.append([])
+            size = 0
+        sections[-1].append(i)
+        size += len(paragraph.text) + 1
+    return sections
+
+
+def tag_texts(texts: Iterable[str], model_choice: str, max_workers: int = 4, tagger=None, **options) -> Iterator[Dict]:
+    """
+    Tags pages or sections concurrently as they arrive, yielding results in input order as they become available.
+
+    Args:
+        texts (Iterable[str]): The page or section texts, e.g. a generator of pages being extracted.
+        model_choice (str): The name of the selected model.
+        max_workers (int): The maximum number of texts tagged concurrently.
+        tagger (PIITagger): The tagger to use; defaults to the shared tagger.
+        **options: Options passed on to PIITagger.tag_pii_elements_chunked.
+
+    Yields:
+        Dict: The final tagging state of each text.
+    """
+    if tagger is None:
+        from masking_agent import get_tagger
+        tagger = get_tagger()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for text in texts:
+            pending.append(executor.submit(tagger.tag_pii_elements_chunked, model_choice, text, **options))
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def mask_pdf(path: str, out_path: str, model_choice: str = "GPT 3.5", max_workers: int = 4, ocr: bool = True,
+             **options) -> int:
+    """
+    Masks a PDF by redacting each tagged PII value where it occurs on its page and overlaying the fake value.
+
+    Pages are tagged as they are extracted, and only the words at the tagged positions are redacted.
+
+    Args:
+        path (str): The PDF file.
+        out_path (str): The masked PDF to write.
+        model_choice (str): The name of the selected model.
+        max_workers (int): The number of pages tagged, and processes extracting text, concurrently.
+        ocr (bool): Whether to OCR pages without a text layer.
+        **options: Options passed on to PIITagger.tag_pii_elements_chunked.
+
+    Returns:
+        int: The number of values redacted.
+    """
+    import fitz
+    pages: List[PdfPage] = []
+
+    def page_texts() -> Iterator[str]:
+        for page in extract_pdf_pages(path, max_workers=max_workers, ocr=ocr):
+            pages.append(page)
+            yield page[1]
+
+    redacted = 0
+    with fitz.open(path) as document:
+        responses = tag_texts(page_texts(), model_choice, max_workers=max_workers, **options)
+        # the i-th result is yielded only after the i-th page was extracted
+        for i, response in enumerate(responses):
+            number, text, words = pages[i]
+            tagged_text = response["transformed_data"].tagged_text or ""
+            _, _, fake_values = mask_text(tagged_text)
+            spans = [span for span in extract_spans(tagged_text, text) if (span[2], text[span[0]:span[1]]) in fake_values]
+            page = document[number]
+            for (start, end, tag), rects in zip(spans, word_rects(text, words, spans)):
+                for n, rect in enumerate(rects):
+                    rect = fitz.Rect(rect)
+                    # the fake value goes into the first line of a value that wraps
+                    fake = fake_values[(tag, text[start:end])] if n == 0 else ""
+                    page.add_redact_annot(rect, text=fake, fontsize=max(4, rect.height * 0.7))
+                    redacted += 1
+            page.apply_redactions()
+        document.save(out_path, garbage=3, deflate=True)
+    return redacted
+
+
+def mask_docx(path: str, out_path: str, model_choice: str = "GPT 3.5", max_workers: int = 4, **options) -> int:
+    """
+    Masks a DOCX section by section, rewriting each paragraph with its masked text.
+
+    Paragraph styles are kept, but character formatting within a rewritten paragraph is reset.
+
+    Args:
+        path (str): The DOCX file.
+        out_path (str): The masked DOCX to write.
+        model_choice (str): The name of the selected model.
+        max_workers (int): The maximum number of sections tagged concurrently.
+        **options: Options passed on to PIITagger.tag_pii_elements_chunked.
+
+    Returns:
+        int: The number of paragraphs rewritten.
+    """
+    import docx
+    document = docx.Document(path)
+    paragraphs = docx_paragraphs(document)
+    sections = docx_sections(paragraphs)
+    # offsets are computed from this snapshot, as paragraphs are rewritten while results come in
+    paragraph_texts = [paragraph.text for paragraph in paragraphs]
+    texts = ["\n".join(paragraph_texts[i] for i in section) for section in sections]
+    rewritten = 0
+    for section, text, response in zip(sections, texts, tag_texts(texts, model_choice, max_workers=max_workers, **options)):
+        spans = extract_spans(response["transformed_data"].tagged_text or "", text)
+        offset = 0
+        for i in section:
+            paragraph_text = paragraph_texts[i]
+            end = offset + len(paragraph_text)
+            paragraph_spans = [(start - offset, stop - offset, tag) for start, stop, tag in spans
+                               if start >= offset and stop <= end]
+            if paragraph_spans:
+                masked_text, _, _ = mask_text(render_tagged_text(paragraph_text, paragraph_spans))
+                paragraphs[i].text = masked_text
+                rewritten += 1
+            offset = end + 1
+    document.save(out_path)
+    return rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="PDF or DOCX file")
+    parser.add_argument("-o", "--output", required=True, help="masked file to write, of the same type")
+    parser.add_argument("--model", default="GPT 3.5", help="model choice, e.g. 'GPT 3.5' or 'GPT 4'")
+    parser.add_argument("--workers", type=int, default=4, help="pages or sections processed concurrently")
+    parser.add_argument("--no-ocr", action="store_true", help="skip OCR of pages without a text layer")
+    parser.add_argument("--output-mode", default="spans", choices=["tagged", "spans"])
+    parser.add_argument("--rules", default="prepass", choices=["off", "prepass", "only"])
+    args = parser.parse_args()
+
+    options = {"output_mode": args.output_mode, "rules_mode": args.rules}
+    suffix = os.path.splitext(args.input)[1].lower()
+    if suffix == ".pdf":
+        count = mask_pdf(args.input, args.output, args.model, args.workers, ocr=not args.no_ocr, **options)
+        print(f"redacted {count} values")
+    elif suffix == ".docx":
+        count = mask_docx(args.input, args.output, args.model, args.workers, **options)
+        print(f"rewrote {count} paragraphs")
+    else:
+        parser.error(f"unsupported file type '{suffix}', expected .pdf or .docx")
+
+
+if __name__ == "__main__":
+    main()
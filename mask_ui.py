@@ -3,19 +3,61 @@ import streamlit as st
 import streamlit.components.v1 as components
 from mask_utils import highlight_text, mask_text
 from style import text_box_style
-from masking_agent import PIITagger
+from masking_agent import get_tagger, default_cascade, escalation_rates
+from chunking import split_text
+from metrics import metrics
 
-def tag_pii(model_choice: str, input_text: str) -> None:
+def stream_tags(model_choice: str, input_text: str, placeholder) -> dict:
+    """
+    Tags the PII in the given input text, rendering the highlighted tagged text as it is generated.
+
+    Args:
+        model_choice (str): The name of the model to use for masking.
+        input_text (str): The input text to mask.
+        placeholder: The Streamlit placeholder to render progress into.
+
+    Returns:
+        dict: The final state of the tagging graph.
+    """
+    pii_tagger = get_tagger()
+    status = "Starting"
+    for event in pii_tagger.stream_pii_elements(model_choice, input_text):
+        if event["event"] == "error":
+            raise event["error"]
+        if event["event"] == "result":
+            placeholder.empty()
+            return event["state"]
+        if event["event"] == "node_started":
+            status = f"Running {event['node']}"
+        if event["event"] == "node_finished" and "generation_quality" in event:
+            status = f"Reflection verdict: {event['generation_quality']}"
+        with placeholder.container():
+            st.caption(status)
+            if event.get("tagged_text") is not None:
+                boxed_text = f'''<div {text_box_style}>{highlight_text(event["tagged_text"])}</div>'''
+                components.html(boxed_text, height=600, scrolling=True)
+
+
+def tag_pii(model_choice: str, input_text: str, placeholder=None) -> None:
     """
     Masks the PII in the given input text using the specified model and updates the session state.
+
+    Short texts are streamed into the placeholder as they are tagged; longer texts are tagged in parallel chunks.
+    With the "Cascade" model choice, chunks are tagged with the cheapest model and only escalated on failure.
     
     Args:
         model_choice (str): The name of the model to use for masking.
         input_text (str): The input text to mask.
+        placeholder: The Streamlit placeholder to render progress into, if any.
     """
     try:
-        pii_tagger = PIITagger()
-        response = pii_tagger.tag_pii_elements(model_choice, input_text)
+        pii_tagger = get_tagger()
+        if model_choice == "Cascade":
+            response = pii_tagger.tag_pii_elements_chunked(default_cascade[0], input_text, models=default_cascade)
+        elif placeholder is not None and len(split_text(input_text)) <= 1:
+            response = stream_tags(model_choice, input_text, placeholder)
+        else:
+            response = pii_tagger.tag_pii_elements_chunked(model_choice, input_text)
         tagged_text = response['transformed_data'].tagged_text
         identifiers = response['transformed_data'].identifiers
         
@@ -30,7 +72,7 @@ def mask_pii():
     try:
         tagged_text = st.session_state.tagged_text
         identifiers_dict = st.session_state.identifiers.dict()
-        st.session_state.masked_text, st.session_state.masked_text_with_highlights = mask_text(tagged_text, identifiers_dict)
+        st.session_state.masked_text, st.session_state.masked_text_with_highlights, st.session_state.fake_values = mask_text(tagged_text, identifiers_dict)
     except Exception as e:
         st.error(f"Error masking PII elements: {str(e)}")
 
@@ -67,8 +109,13 @@ col1, col2 = st.columns(2)
 with col1:
     input_text = st.text_area("Original Text", value=demo_text, height=300)
     if not st.session_state.identifiers:
-        model_choice = st.radio("Select LLM:", options=["GPT 3.5", "GPT 4"], horizontal=True)
-        mask = st.button("Tag PII", on_click=tag_pii, args=[model_choice, input_text])
+        model_choice = st.radio("Select LLM:", options=["GPT 3.5", "GPT 4", "Cascade"], horizontal=True)
+        if st.button("Tag PII"):
+            with col2:
+                progress = st.empty()
+            tag_pii(model_choice, input_text, progress)
+            if st.session_state.identifiers:
+                st.rerun()
 
 if st.session_state.identifiers: 
     with col2:
@@ -86,3 +133,14 @@ if st.session_state.identifiers:
         # formatted_masked_text = f'<div style="border: 1px solid black; border-radius: 10px; background-color: #f0f0f0; padding: 10px; font-family: Helvetica; font-size: 10">{st.session_state.masked_text_with_highlights}</div>'
         formatted_masked_text = f'''<div {text_box_style}>{st.session_state.masked_text_with_highlights}</div>'''
         components.html(formatted_masked_text, height=400, scrolling=True)
+
+with st.sidebar:
+    st.subheader("Metrics")
+    for model_choice, rate in escalation_rates().items():
+        st.metric(f"Escalated from {model_choice}", f"{rate:.0%}")
+    metric_rows = metrics.summary()
+    if metric_rows:
+        st.dataframe([{**row, "labels": ", ".join(f"{k}={v}" for k, v in row["labels"].items())}
+                      for row in metric_rows], hide_index=True)
+    else:
+        st.write("No metrics recorded yet")
@@ -1,6 +1,8 @@
+import html
 import re
-from faker import Faker
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
+from pseudonym import Pseudonymizer, get_pseudonymizer
+from metrics import metrics
 
 # Maps entity types to colors for highlighting
 color_map: Dict[str, str] = {
@@ -18,63 +20,97 @@ color_map: Dict[str, str] = {
     'country': '#DC143C',  # Crimson
 }
 
-# Maps entity types to colors for highlighting
-fake = Faker()
-faker_func: Dict[str, str] = {
-    'first_name': fake.first_name,
-    'last_name': fake.last_name,
-    'middle_name': lambda x: '',
-    'phone': fake.phone_number, 
-    'email': fake.safe_email,
-    'address_line_1': fake.street_address, 
-    'address_line_2': fake.street_address,
-    'city': fake.city, 
-    'state': fake.state,
-    'zipcode': fake.zipcode,
-    'company': fake.company,
-    'country': fake.country,
-}
+# Matches a tagged value for any entity type in color_map. Values cannot contain '<', so
+# nested or unclosed tags fail fast at the next tag instead of scanning to the end of the text.
+tag_pattern = re.compile('<(' + '|'.join(color_map) + ')>([^<]*)</\\1>')
+highlight_templates: Dict[str, str] = {tag: f'<span style="color:{color}">**{{}}**</span>' for tag, color in color_map.items()}
+
+
+def tokenize_tagged_text(tagged_text: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Splits tagged text into plain and tagged segments in a single pass.
+
+    Args:
+        tagged_text (str): The input text with PII tagged.
+
+    Returns:
+        List[Tuple[Optional[str], str]]: (entity, value) segments, with entity None for plain text.
+    """
+    segments: List[Tuple[Optional[str], str]] = []
+    cursor = 0
+    for match in tag_pattern.finditer(tagged_text):
+        if match.start() > cursor:
+            segments.append((None, tagged_text[cursor:match.start()]))
+        segments.append((match.group(1), match.group(2)))
+        cursor = match.end()
+    if cursor < len(tagged_text):
+        segments.append((None, tagged_text[cursor:]))
+    return segments
 
 
+@metrics.timed("pii_mask_seconds", function="highlight_text")
 def highlight_text(tagged_text: str) -> str:
     """
     Highlights the tagged entities in the given text using HTML and CSS.
-    
+
+    All entity types are highlighted in one pass of the precompiled tag_pattern, and the
+    enclosed values are HTML-escaped.
+
     Args:
         tagged_text (str): The input text with tagged entities.
-        
+
     Returns:
         str: The input text with tags replaced with colors for entities.
     """
-    # Define the color mapping for each tag
-    for tag, color in color_map.items():
-        pattern = re.compile(f'<{tag}>(.*?)</{tag}>')
-        tagged_text = pattern.sub(f'<span style="color:{color}">**\\1**</span>', tagged_text)
+    # split yields [text, tag, value, text, tag, value, ..., text]
+    parts = tag_pattern.split(tagged_text)
+    highlighted = []
+    for i in range(0, len(parts) - 1, 3):
+        highlighted.append(parts[i])
+        highlighted.append(highlight_templates[parts[i + 1]].format(html.escape(parts[i + 2], quote=False)))
+    highlighted.append(parts[-1])
+    return ''.join(highlighted)
 
-    return tagged_text
 
-
-def mask_text(tagged_text: str, identifiers: Dict[str, list]) -> Tuple[str, str]:
+@metrics.timed("pii_mask_seconds", function="mask_text")
+def mask_text(tagged_text: str, identifiers: Optional[Dict[str, list]] = None,
+              pseudonymizer: Optional[Pseudonymizer] = None) -> Tuple[str, str, Dict[Tuple[str, str], str]]:
     """
     Masks the tagged entities in the given text with fake values.
-    
+
+    The tagged text is parsed once, all fakes are looked up in one bulk call, and both outputs
+    are built in the same pass. Fakes are deterministic per (entity type, value), so the same
+    value gets the same fake in every document masked with the same pseudonymizer key.
+
     Args:
         tagged_text (str): The input text with PII tagged.
-        identifiers (Dict[str, list]): A dictionary mapping entity types to lists of entity values.
-        
+        identifiers (Optional[Dict[str, list]]): A dictionary mapping entity types to lists of entity values.
+            Only listed values are masked; if None, every tagged value is masked.
+        pseudonymizer (Optional[Pseudonymizer]): Generates the fakes; defaults to the process-wide pseudonymizer.
+
     Returns:
-        Tuple[str, str]: A tuple containing the masked text and the masked text with highlights.
+        Tuple[str, str, Dict[Tuple[str, str], str]]: A tuple containing the masked text, the masked text with
+            highlights, and the mapping of (entity type, original value) to fake values.
     """
-    fake_values = {}
-    masked_text = tagged_text
-    masked_text_with_highlights = tagged_text
-    for entity, values in identifiers.items():
-        color = color_map[entity]                
-        masking_func = faker_func[entity]
-        for value in values:           
-            masked_value = masking_func()
-            highlighted_value = f'<span style="color:{color}">**{masked_value}**</span>'
-            masked_text = masked_text.replace(f'<{entity}>{value}</{entity}>', masked_value)  
-            masked_text_with_highlights = masked_text_with_highlights.replace(f'<{entity}>{value}</{entity}>', highlighted_value)
-            fake_values[value] = masked_value
-    return masked_text, masked_text_with_highlights
\ No newline at end of file
+    listed = None
+    if identifiers is not None:
+        listed = {(entity, value) for entity, values in identifiers.items() for value in values or []}
+    segments = tokenize_tagged_text(tagged_text)
+    pairs = [segment for segment in segments if segment[0] is not None and (listed is None or segment in listed)]
+    fake_values = (pseudonymizer or get_pseudonymizer()).pseudonymize_many(pairs)
+    masked_parts: List[str] = []
+    highlighted_parts: List[str] = []
+    for entity, value in segments:
+        if entity is None:
+            masked_parts.append(value)
+            highlighted_parts.append(value)
+            continue
+        masked_value = fake_values.get((entity, value))
+        if masked_value is None:
+            # unlisted values keep their tags, as they are not part of the identified PII
+            masked_parts.append(f'<{entity}>{value}</{entity}>')
+            highlighted_parts.append(f'<{entity}>{value}</{entity}>')
+            continue
+        masked_parts.append(masked_value)
+        highlighted_parts.append(highlight_templates[entity].format(html.escape(masked_value, quote=False)))
+    return ''.join(masked_parts), ''.join(highlighted_parts), fake_values
@@ -1,23 +1,259 @@
-from typing import Dict, TypedDict, Annotated, Sequence
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypedDict, Annotated, Sequence
+import asyncio
+import inspect
 import operator
 import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import weakref
+from uuid import UUID
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
-from entities import TransformedData, ReflectionOuput
-from prompts import pii_prompt_template, pii_reflect_template
-from langchain.pydantic_v1 import BaseModel, Field
+from entities import Identifiers, TransformedData, ExtractedEntities, PackedOutput, ReflectionOuput, Defect
+from prompts import pii_prompt_template, pii_span_prompt_template, pii_packed_prompt_template, pii_reflect_template, pii_repair_template, entity_descriptions
+from validator import validate, format_defects, strip_tags, span_pattern
+from chunking import split_text
+from span_utils import Span, extract_spans, merge_spans, overlay_spans, render_tagged_text, identifiers_from_spans, locate_values
+from rules import detect_entities, prepass_types
+from ner import ner_spans, ner_spans_batch
+from cache import ResultCache, cache_key
+from metrics import metrics
+from langchain.pydantic_v1 import BaseModel, Field, ValidationError
 from textwrap import dedent
 
 
+logger = logging.getLogger("pii_assistant.tagger")
+
+
 class ReflectionOuput(BaseModel):
     review: str = Field(default="n/a", description="Review of the TransformedData as to how well it aligns with the expected format")
     recommendations: str = Field(default="n/a", description="Actionable recommendations formatted as a multiline string containing bulleted list of necessary changes to align with original formatting instructions and improvement if needed for any attribute. Use examples as needed. If the TransformedData matches all requirements say so.")
     feedback: str = Field(default="n/a", description="'perfect' if no changes are required, or 'needs work' otherwise")
     
     
+# Maps model choices shown in the UI to OpenAI model names
+model_names: Dict[str, str] = {
+    "GPT 3.5": "gpt-3.5-turbo-0125",
+    "GPT 4": "gpt-4-0125-preview",
+}
+
+# Process-wide registry of chat model clients keyed by (model choice, temperature)
+_model_registry: Dict[Tuple[str, float], ChatOpenAI] = {}
+_model_registry_lock = threading.Lock()
+
+
+def get_model(model_choice: str, temperature: float = 0.0) -> ChatOpenAI:
+    """
+    Returns a shared chat model client, creating it on first use.
+
+    Args:
+        model_choice (str): The name of the selected model.
+        temperature (float): The sampling temperature.
+
+    Returns:
+        ChatOpenAI: The cached chat model.
+    """
+    key = (model_choice, temperature)
+    llm = _model_registry.get(key)
+    if llm is None:
+        with _model_registry_lock:
+            llm = _model_registry.get(key)
+            if llm is None:
+                llm = ChatOpenAI(model_name=model_names[model_choice], temperature=temperature)
+                _model_registry[key] = llm
+    return llm
+
+
+def register_model(model_choice: str, llm: BaseChatModel, temperature: float = 0.0) -> None:
+    """
+    Registers a chat model under a model choice, e.g. an offline fake model for benchmarks.
+
+    Args:
+        model_choice (str): The name the model is selected by.
+        llm (BaseChatModel): The chat model.
+        temperature (float): The sampling temperature the model is registered for.
+    """
+    with _model_registry_lock:
+        _model_registry[(model_choice, temperature)] = llm
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    def __init__(self, model_choice: str, node: str = "unknown"):
+        """
+        Records the prompt and completion tokens of every LLM call in a run, labelled by model and graph node.
+
+        Args:
+            model_choice (str): The model choice the tokens are recorded under.
+            node (str): The node label of calls made outside a graph node, e.g. by the packed prompt.
+        """
+        self.model_choice = model_choice
+        self.node = node
+        # graph node of every call in flight, keyed by run_id; nodes may call the model concurrently
+        self._nodes: Dict[UUID, str] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[Dict] = None,
+                            **kwargs) -> None:
+        self._nodes[run_id] = (metadata or {}).get("langgraph_node", self.node)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        self._nodes.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        node = self._nodes.pop(run_id, self.node)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        if not usage:
+            # streamed responses and newer clients report usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    message_usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += message_usage.get("input_tokens", 0)
+                    completion_tokens += message_usage.get("output_tokens", 0)
+        metrics.increment("pii_llm_calls_total", model=self.model_choice, node=node)
+        if prompt_tokens or completion_tokens:
+            metrics.increment("pii_llm_tokens_total", prompt_tokens, model=self.model_choice, node=node, kind="prompt")
+            metrics.increment("pii_llm_tokens_total", completion_tokens, model=self.model_choice, node=node,
+                              kind="completion")
+
+
+# Model choices tried in order by tag_pii_elements_cascade, cheapest first
+default_cascade = ("GPT 3.5", "GPT 4")
+
+
+def escalation_rates(models: Sequence[str] = default_cascade) -> Dict[str, float]:
+    """
+    Reports the share of cascade results escalated away from each model but the last, since process start.
+
+    Args:
+        models (Sequence[str]): The cascade's model choices.
+
+    Returns:
+        Dict[str, float]: Maps model choices to the escalated share of the results they produced.
+    """
+    rates = {}
+    for model_choice in models[:-1]:
+        escalated = metrics.total("pii_cascade_results_total", model=model_choice, result="escalated")
+        accepted = metrics.total("pii_cascade_results_total", model=model_choice, result="accepted")
+        rates[model_choice] = escalated / (escalated + accepted) if escalated + accepted else 0.0
+    return rates
+
+
+# Maximum number of in-flight async LLM calls per model, shared by all atag_pii_elements calls on an event loop
+max_concurrent_calls = int(os.environ.get("PII_MAX_CONCURRENT_LLM_CALLS", "16"))
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def get_semaphore(model_choice: str) -> asyncio.Semaphore:
+    """
+    Returns the semaphore limiting in-flight LLM calls for a model on the running event loop.
+
+    Args:
+        model_choice (str): The name of the selected model.
+
+    Returns:
+        asyncio.Semaphore: The shared semaphore.
+    """
+    semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if model_choice not in semaphores:
+        semaphores[model_choice] = asyncio.Semaphore(max_concurrent_calls)
+    return semaphores[model_choice]
+
+
+# Matches the (possibly unterminated) tagged_text string in a partial JSON response
+_partial_tagged_text_pattern = re.compile(r'"tagged_text"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+
+def partial_tagged_text(content: str) -> Optional[str]:
+    """
+    Extracts the tagged text streamed so far from a partial JSON response.
+
+    Args:
+        content (str): The LLM output received so far.
+
+    Returns:
+        Optional[str]: The decoded tagged text so far, or None if it has not started.
+    """
+    match = _partial_tagged_text_pattern.search(content)
+    if match is None:
+        return None
+    # drop an escape sequence cut off at the end of the stream before decoding
+    value = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', '', match.group(1))
+    try:
+        return json.loads(f'"{value}"')
+    except ValueError:
+        return None
+
+
+def pack_texts(input_texts: List[str]) -> str:
+    """
+    Joins texts for the packed prompt, delimiting each one with its ID, the text's position in input_texts.
+
+    Args:
+        input_texts (List[str]): The texts to pack.
+
+    Returns:
+        str: The delimited texts.
+    """
+    return "\n".join(f"--- BEGIN TEXT {i} ---\n{text}\n--- END TEXT {i} ---" for i, text in enumerate(input_texts))
+
+
+def _event_sink(config: Optional[RunnableConfig]) -> Optional[Callable[[Dict], None]]:
+    """
+    Returns the callback receiving graph events for this run, if any.
+
+    Args:
+        config (Optional[RunnableConfig]): The config the graph was invoked with.
+
+    Returns:
+        Optional[Callable[[Dict], None]]: The event sink.
+    """
+    return ((config or {}).get("configurable") or {}).get("event_sink")
+
+
+def _event_summary(update: Dict) -> Dict:
+    """
+    Picks the fields of a node's state update that are reported in node_finished events.
+
+    Args:
+        update (Dict): The state update returned by a node.
+
+    Returns:
+        Dict: The reported fields.
+    """
+    summary = {key: update[key] for key in ("generation_quality", "reflection_rounds") if key in update}
+    if update.get("transformed_data") is not None:
+        summary["tagged_text"] = update["transformed_data"].tagged_text
+    if "defects" in update:
+        summary["defects"] = len(update["defects"])
+    return summary
+
+
+# Reflection policies accepted by tag_pii_elements
+REFLECTION_MODES = ("always", "never", "on_failure")
+
+# Output modes accepted by tag_pii_elements: the LLM echoes tagged text, or returns entity values only
+OUTPUT_MODES = ("tagged", "spans")
+
+# Rule-based detection: disabled, as a pre-pass before the LLM, or on its own without the LLM
+RULES_MODES = ("off", "prepass", "only")
+
+# Tagging engines: the LLM, local spaCy NER and rules only, or local tagging verified by the LLM
+ENGINES = ("llm", "local", "local_verify")
+
+
 class GraphState(TypedDict):
     model_choice: str
     original_text: str
@@ -25,12 +261,24 @@ class GraphState(TypedDict):
     reflection_status: str
     transformed_data: TransformedData
     generation_quality: str
+    reflection_mode: str
+    max_reflections: int
+    reflection_rounds: int
+    defects: List[Defect]
+    output_mode: str
+    rules_mode: str
+    rule_spans: List[Span]
+    engine: str
 
 
 class PIITagger:
-    def __init__(self):
+    def __init__(self, cache: Optional[ResultCache] = None):
+        self.cache = cache
         self.parser = PydanticOutputParser(pydantic_object=TransformedData)
+        self.span_parser = PydanticOutputParser(pydantic_object=ExtractedEntities)
+        self.packed_parser = PydanticOutputParser(pydantic_object=PackedOutput)
         self.wf = self._create_workflow()
+        self.awf = self._create_workflow(asynchronous=True)
 
     def _model_from_selection(self, model_selection: str) -> ChatOpenAI:
         """
@@ -42,17 +290,151 @@ class PIITagger:
         Returns:
             ChatOpenAI: The initialized chat model.
         """
-        temperature = 0.0
-        model_dict: Dict[str, ChatOpenAI] = {
-            "GPT 3.5": ChatOpenAI(model_name="gpt-3.5-turbo-0125", temperature=temperature),
-            "GPT 4": ChatOpenAI(model_name="gpt-4-0125-preview", temperature=temperature),
-        }
-        return model_dict[model_selection]
+        return get_model(model_selection, temperature=0.0)
     
 
+    def _parser_for(self, state: GraphState) -> PydanticOutputParser:
+        """
+        Returns the output parser for the output mode of the current state.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            PydanticOutputParser: The parser for TransformedData or ExtractedEntities.
+        """
+        if state.get("output_mode", "tagged") == "spans":
+            return self.span_parser
+        return self.parser
+
+
+    def _from_entities(self, entities: ExtractedEntities, original_text: str) -> TransformedData:
+        """
+        Builds TransformedData by locating the extracted entity values in the original text.
+
+        Args:
+            entities (ExtractedEntities): The entities returned by the LLM.
+            original_text (str): The text that was tagged.
+
+        Returns:
+            TransformedData: The identifiers and locally tagged text.
+        """
+        pairs = [(entity.type, entity.value) for entity in entities.entities if entity.type in Identifiers.__fields__]
+        spans = locate_values(original_text, pairs)
+        identifiers = identifiers_from_spans(original_text, spans)
+        for tag, value in pairs:
+            # keep values that could not be located so validation reports them
+            if value.strip() not in identifiers.get(tag, []):
+                identifiers.setdefault(tag, []).append(value.strip())
+        return TransformedData(
+            identifiers=Identifiers(**identifiers),
+            tagged_text=render_tagged_text(original_text, spans)
+        )
+
+
+    def _from_spans(self, spans: List[Span], original_text: str) -> TransformedData:
+        """
+        Builds TransformedData from spans of the original text.
+
+        Args:
+            spans (List[Span]): Sorted, non-overlapping spans.
+            original_text (str): The text that was tagged.
+
+        Returns:
+            TransformedData: The identifiers and tagged text.
+        """
+        return TransformedData(
+            identifiers=Identifiers(**identifiers_from_spans(original_text, spans)),
+            tagged_text=render_tagged_text(original_text, spans)
+        )
+
+
+    def _detect(self, state: GraphState) -> Dict:
+        """
+        Detects PII elements with local rules, and spaCy NER for local engines, before prompting the LLM.
+
+        Only emails, phones and zip codes are kept as rule spans that take precedence over the LLM; ambiguous
+        state and country matches are used only when tagging without the LLM.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            Dict: The updated state with the rule spans, and the transformed data when tagged locally.
+        """
+        rules_mode = state.get("rules_mode", "off")
+        engine = state.get("engine", "llm")
+        if rules_mode == "off" and engine == "llm":
+            return {"rule_spans": []}
+        rule_spans = detect_entities(state["original_text"], types=prepass_types)
+        if engine == "llm" and rules_mode == "prepass":
+            return {"rule_spans": rule_spans}
+        spans = detect_entities(state["original_text"])
+        if engine != "llm":
+            spans = overlay_spans(spans, ner_spans(state["original_text"]))
+        transformed_data = self._from_spans(spans, state["original_text"])
+        return {
+            "rule_spans": rule_spans,
+            "transformed_data": transformed_data,
+            "defects": validate(transformed_data, state["original_text"]),
+            "reflection_rounds": 0
+        }
+
+
+    def _should_prompt(self, state: GraphState) -> str:
+        """
+        Determines whether to prompt the LLM or end the graph in rules-only mode, for the local engine, and
+        for the local_verify engine when the reflection policy allows no review.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            str: The next action to take ('prompt' or 'end').
+        """
+        if state.get("rules_mode", "off") == "only" or state.get("engine", "llm") == "local":
+            return "end"
+        if state.get("engine", "llm") == "local_verify" and (
+                state.get("reflection_mode", "on_failure") == "never" or state.get("max_reflections", 1) <= 0):
+            # the LLM review is a reflection round, so it counts against the reflection budget
+            return "end"
+        return "prompt"
+
+
+    def _should_verify(self, state: GraphState) -> str:
+        """
+        Determines whether to have the LLM generate, or reflect on the locally tagged data.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            str: The next action to take ('generate' or 'reflect').
+        """
+        if state.get("engine", "llm") == "local_verify":
+            return "reflect"
+        return "generate"
+
+
+    def _entity_types(self, skipped: Sequence[str] = ()) -> str:
+        """
+        Lists the entity types and their descriptions for the prompts that take an entity_types variable.
+
+        Args:
+            skipped (Sequence[str]): Entity types to leave out.
+
+        Returns:
+            str: One 'type: description' line per entity type.
+        """
+        # the placeholder is indented in the templates, so only the following lines are indented here
+        return "\n        ".join(
+            f"{entity}: {description}" for entity, description in entity_descriptions.items() if entity not in skipped
+        )
+
+
     def _prompt(self, state: GraphState) -> Dict:
         """
-        Generates a prompt for tagging PII using the pii_prompt_template
+        Generates a prompt for tagging PII using the pii_prompt_template, or pii_span_prompt_template in spans mode
 
         Args:
             state (GraphState): The current state of the graph.
@@ -63,23 +445,37 @@ class PIITagger:
         prompt = ChatPromptTemplate.from_messages(messages=pii_prompt_template)
         input_data = {
             "text": state["original_text"],
-            "format_instructions": self.parser.get_format_instructions()
+            "format_instructions": self._parser_for(state).get_format_instructions()
         }
+        if state.get("output_mode", "tagged") == "spans":
+            # entity types already covered by the rule pre-pass are left out of the LLM's task
+            skipped = prepass_types if state.get("rules_mode", "off") == "prepass" else ()
+            prompt = ChatPromptTemplate.from_messages(messages=pii_span_prompt_template)
+            input_data["entity_types"] = self._entity_types(skipped)
         response = prompt.invoke(input_data)
+        messages = response.messages
+        if state.get("engine", "llm") == "local_verify":
+            # present the local tagging as the first generation so the reflect node reviews it
+            messages = [*messages, AIMessage(content=json.dumps(state["transformed_data"].dict(), indent=4))]
         return {
-            "messages": response.messages,
+            "messages": messages,
             "model_choice": state["model_choice"],
             "reflection_status": "n/a",
-            "generation_quality": 'n/a'
+            "generation_quality": 'n/a',
+            "reflection_rounds": 0
         }
 
 
-    def _generate(self, state: GraphState) -> Dict:
+    def _generate(self, state: GraphState, config: Optional[RunnableConfig] = None) -> Dict:
         """
         Invoke LLM to identify PII and apply tags as specified in the prompt and TransformedData
 
+        When the run has an event sink, the LLM output is streamed and the tagged text received
+        so far is reported in 'partial' events.
+
         Args:
             state (GraphState): The current state of the graph.
+            config (Optional[RunnableConfig]): The run config, carrying the event sink if streaming.
 
         Returns:
             Dict: The updated state with the generated transformed data.
@@ -87,12 +483,74 @@ class PIITagger:
         messages = state['messages']
         model_choice = state['model_choice']
         llm = self._model_from_selection(model_choice)
-        chain = llm | self.parser
-        response = chain.invoke(messages)
+        parser = self._parser_for(state)
+        sink = _event_sink(config)
+        if sink is None:
+            chain = llm | parser
+            response = chain.invoke(messages)
+        else:
+            content = ""
+            for chunk in llm.stream(messages):
+                content += chunk.content
+                partial = partial_tagged_text(content)
+                if partial is not None:
+                    sink({"event": "partial", "node": "generate", "tagged_text": partial})
+            response = parser.parse(content)
         # print(f"** generate ** response:\n{response}")
+        return self._generation_update(state, response)
+
+
+    async def _agenerate(self, state: GraphState, config: Optional[RunnableConfig] = None) -> Dict:
+        """
+        Async version of _generate, limited by the model's semaphore.
+
+        Args:
+            state (GraphState): The current state of the graph.
+            config (Optional[RunnableConfig]): The run config, carrying the event sink if streaming.
+
+        Returns:
+            Dict: The updated state with the generated transformed data.
+        """
+        llm = self._model_from_selection(state['model_choice'])
+        parser = self._parser_for(state)
+        sink = _event_sink(config)
+        async with get_semaphore(state['model_choice']):
+            if sink is None:
+                chain = llm | parser
+                response = await chain.ainvoke(state['messages'])
+            else:
+                content = ""
+                async for chunk in llm.astream(state['messages']):
+                    content += chunk.content
+                    partial = partial_tagged_text(content)
+                    if partial is not None:
+                        sink({"event": "partial", "node": "generate", "tagged_text": partial})
+                response = parser.parse(content)
+        return self._generation_update(state, response)
+
+
+    def _generation_update(self, state: GraphState, response) -> Dict:
+        """
+        Converts and validates the parsed LLM response of a generate step.
+
+        Args:
+            state (GraphState): The current state of the graph.
+            response (TransformedData | ExtractedEntities): The parsed LLM response.
+
+        Returns:
+            Dict: The updated state with the generated transformed data.
+        """
+        transformed_data = response
+        if isinstance(response, ExtractedEntities):
+            transformed_data = self._from_entities(response, state["original_text"])
+        if state.get("rule_spans"):
+            llm_spans = extract_spans(transformed_data.tagged_text or "", state["original_text"])
+            llm_spans = [span for span in llm_spans if span[2] in Identifiers.__fields__]
+            transformed_data = self._from_spans(overlay_spans(state["rule_spans"], llm_spans), state["original_text"])
         return {
             "messages": [AIMessage(content=json.dumps(response.dict(), indent=4))],
-            "transformed_data": response
+            "transformed_data": transformed_data,
+            "defects": validate(transformed_data, state["original_text"])
         }
 
 
@@ -106,9 +564,39 @@ class PIITagger:
         Returns:
             Dict: The updated state with the reflection status and generation quality.
         """
+        chain, input = self._reflection_chain(state)
+        response = chain.invoke(input)
+        return self._reflection_update(state, response)
+
+
+    async def _areflect(self, state: GraphState) -> Dict:
+        """
+        Async version of _reflect, limited by the model's semaphore.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            Dict: The updated state with the reflection status and generation quality.
+        """
+        chain, input = self._reflection_chain(state)
+        async with get_semaphore(state['model_choice']):
+            response = await chain.ainvoke(input)
+        return self._reflection_update(state, response)
+
+
+    def _reflection_chain(self, state: GraphState) -> Tuple:
+        """
+        Builds the reflection chain and its input.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            Tuple: The chain and the input to invoke it with.
+        """
         messages = state["messages"]
         model_choice = state['model_choice']
-        generation_quality = state["generation_quality"]
         llm = self._model_from_selection(model_choice)
         prompt = ChatPromptTemplate.from_messages(
             messages=[
@@ -121,8 +609,21 @@ class PIITagger:
         input = {
             "format_instructions": parser.get_format_instructions()
         }
-        response = chain.invoke(input)
-        print(f"response: '{response}'")
+        return chain, input
+
+
+    def _reflection_update(self, state: GraphState, response: ReflectionOuput) -> Dict:
+        """
+        Turns the parsed reflection into feedback for the next generation.
+
+        Args:
+            state (GraphState): The current state of the graph.
+            response (ReflectionOuput): The parsed LLM review.
+
+        Returns:
+            Dict: The updated state with the reflection status and generation quality.
+        """
+        logger.debug("reflection response: %s", response)
         
         review = response.review
         feedback = response.feedback
@@ -147,23 +648,49 @@ class PIITagger:
         return {
             "messages": [message],
             "reflection_status": "completed",
-            "generation_quality": generation_quality
+            "generation_quality": generation_quality,
+            "reflection_rounds": state["reflection_rounds"] + 1
         }
         
 
+    def _repair(self, state: GraphState) -> Dict:
+        """
+        Sends the defects found by local validation back to the LLM as targeted feedback.
+
+        Args:
+            state (GraphState): The current state of the graph.
+
+        Returns:
+            Dict: The updated state with the repair message.
+        """
+        message = HumanMessage(content=pii_repair_template.format(defects=format_defects(state["defects"])))
+        return {
+            "messages": [message],
+            "reflection_status": "completed",
+            "generation_quality": "needs rework",
+            "reflection_rounds": state["reflection_rounds"] + 1
+        }
+
+
     def _should_reflect(self, state: GraphState) -> str:
         """
-        Determines whether to reflect or end the graph based on the reflection status.
+        Determines whether to reflect, repair or end the graph based on the reflection policy.
 
         Args:
             state (GraphState): The current state of the graph.
 
         Returns:
-            str: The next action to take ('reflect' or 'end').
+            str: The next action to take ('reflect', 'repair' or 'end').
         """
-        reflection_status = state["reflection_status"]
-        if reflection_status != "completed":
+        reflection_mode = state.get("reflection_mode", "on_failure")
+        if reflection_mode == "never":
+            return "end"
+        if state["reflection_rounds"] >= state.get("max_reflections", 1):
+            return "end"
+        if reflection_mode == "always":
             return "reflect"
+        if state["defects"]:
+            return "repair"
         return "end"
     
 
@@ -182,24 +709,87 @@ class PIITagger:
             return "generate"
         return "end"
 
-    def _create_workflow(self) -> StateGraph:
+    def _node(self, name: str, func: Callable) -> Callable:
+        """
+        Wraps a node so it records its wall time and reports node_started and node_finished events to the
+        run's event sink.
+
+        Args:
+            name (str): The name of the node.
+            func (Callable): The node function, sync or async, optionally taking the run config.
+
+        Returns:
+            Callable: The wrapped node function.
+        """
+        takes_config = "config" in inspect.signature(func).parameters
+
+        def call(state, config):
+            return func(state, config=config) if takes_config else func(state)
+
+        if inspect.iscoroutinefunction(func):
+            async def node(state: GraphState, config: RunnableConfig) -> Dict:
+                sink = _event_sink(config)
+                if sink is not None:
+                    sink({"event": "node_started", "node": name})
+                start = time.perf_counter()
+                update = await call(state, config)
+                metrics.observe("pii_node_seconds", time.perf_counter() - start, node=name, model=state["model_choice"])
+                if sink is not None:
+                    sink({"event": "node_finished", "node": name, **_event_summary(update)})
+                return update
+        else:
+            def node(state: GraphState, config: RunnableConfig) -> Dict:
+                sink = _event_sink(config)
+                if sink is not None:
+                    sink({"event": "node_started", "node": name})
+                start = time.perf_counter()
+                update = call(state, config)
+                metrics.observe("pii_node_seconds", time.perf_counter() - start, node=name, model=state["model_choice"])
+                if sink is not None:
+                    sink({"event": "node_finished", "node": name, **_event_summary(update)})
+                return update
+        return node
+
+    def _create_workflow(self, asynchronous: bool = False) -> StateGraph:
         """
         Creates the graph.
 
+        Args:
+            asynchronous (bool): Whether to use the async generate and reflect nodes.
+
         Returns:
             StateGraph: The created workflow graph.
         """
         g = StateGraph(GraphState)
-        g.add_node("prompt", self._prompt)
-        g.set_entry_point("prompt")
-        g.add_node("generate", self._generate)
-        g.add_edge("prompt", "generate")
-        g.add_node("reflect", self._reflect)
+        g.add_node("detect", self._node("detect", self._detect))
+        g.set_entry_point("detect")
+        g.add_node("prompt", self._node("prompt", self._prompt))
+        g.add_conditional_edges(
+            "detect",
+            self._should_prompt,
+            {
+                "prompt": "prompt",
+                "end": END
+            }
+        )
+        g.add_node("generate", self._node("generate", self._agenerate if asynchronous else self._generate))
+        g.add_node("reflect", self._node("reflect", self._areflect if asynchronous else self._reflect))
+        g.add_conditional_edges(
+            "prompt",
+            self._should_verify,
+            {
+                "generate": "generate",
+                "reflect": "reflect"
+            }
+        )
+        g.add_node("repair", self._node("repair", self._repair))
+        g.add_edge("repair", "generate")
         g.add_conditional_edges(
             "generate",
             self._should_reflect,
             {
                 "reflect": "reflect",
+                "repair": "repair",
                 "end": END
             }
         )
@@ -213,26 +803,489 @@ class PIITagger:
         )
         return g.compile()
 
-    def tag_pii_elements(self, model_choice, input_text) -> Dict:
+    def tag_pii_elements(self, model_choice, input_text, reflection_mode: str = "on_failure", max_reflections: int = 1,
+                         output_mode: str = "tagged", rules_mode: str = "off", engine: str = "llm",
+                         event_sink: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Transforms PII in the given input text.
 
         Args:
-            input_data (Dict): The input data containing the original text and model choice.
+            model_choice (str): The name of the selected model.
+            input_text (str): The text to tag.
+            reflection_mode (str): 'always' to have the LLM reflect on every generation, 'never' to skip reflection,
+                or 'on_failure' to send targeted repair feedback only when local validation finds defects.
+            max_reflections (int): The maximum number of reflection rounds.
+            output_mode (str): 'tagged' to have the LLM echo the text with tags, or 'spans' to have it
+                return entity values only and tag the text locally.
+            rules_mode (str): 'off' to leave detection to the LLM, 'prepass' to detect emails, phones and zip codes
+                with local rules first, or 'only' to skip the LLM entirely and also tag states and countries by rules.
+            engine (str): 'llm' to tag with the LLM, 'local' to tag with spaCy NER and rules only, or
+                'local_verify' to tag locally and have the LLM review, and if needed redo, the result. The review
+                is a reflection round, so with reflection_mode 'never' or max_reflections 0 the local result is
+                returned as is.
+            event_sink (Optional[Callable[[Dict], None]]): Receives node and partial output events as the graph runs.
 
         Returns:
-            Dict: The transformed data.
+            Dict: The final graph state, including transformed_data, defects, reflection_rounds and cache_hit.
         """
+        input, key = self._graph_input(model_choice, input_text, reflection_mode, max_reflections, output_mode,
+                                       rules_mode, engine)
+        cached = self._cached_response(input, key)
+        if cached is not None:
+            return cached
+        # each reflection round adds a reflect and a generate step to the graph
+        config = {"recursion_limit": 2 * max_reflections + 10, "configurable": {"event_sink": event_sink},
+                  "callbacks": [TokenUsageHandler(model_choice)]}
+        start = time.perf_counter()
+        response = self.wf.invoke(input, config=config)
+        return self._store_response(response, key, time.perf_counter() - start)
+
+    async def atag_pii_elements(self, model_choice, input_text, reflection_mode: str = "on_failure",
+                                max_reflections: int = 1, output_mode: str = "tagged", rules_mode: str = "off",
+                                engine: str = "llm", event_sink: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Async version of tag_pii_elements. LLM calls are awaited, and limited per model by a semaphore shared
+        across all calls on the event loop.
+
+        Args:
+            model_choice (str): The name of the selected model.
+            input_text (str): The text to tag.
+            reflection_mode (str): See tag_pii_elements.
+            max_reflections (int): The maximum number of reflection rounds.
+            output_mode (str): See tag_pii_elements.
+            rules_mode (str): See tag_pii_elements.
+            engine (str): See tag_pii_elements.
+            event_sink (Optional[Callable[[Dict], None]]): See tag_pii_elements.
+
+        Returns:
+            Dict: The final graph state, including transformed_data, defects, reflection_rounds and cache_hit.
+        """
+        input, key = self._graph_input(model_choice, input_text, reflection_mode, max_reflections, output_mode,
+                                       rules_mode, engine)
+        cached = self._cached_response(input, key)
+        if cached is not None:
+            return cached
+        config = {"recursion_limit": 2 * max_reflections + 10, "configurable": {"event_sink": event_sink},
+                  "callbacks": [TokenUsageHandler(model_choice)]}
+        start = time.perf_counter()
+        response = await self.awf.ainvoke(input, config=config)
+        return self._store_response(response, key, time.perf_counter() - start)
+
+    def stream_pii_elements(self, model_choice, input_text, **kwargs) -> Iterator[Dict]:
+        """
+        Transforms PII in the given input text, yielding graph events as they happen.
+
+        Events are dicts with an 'event' key: 'node_started' and 'node_finished' (with the node name and,
+        when available, tagged_text, defects, generation_quality and reflection_rounds), 'partial' (the
+        tagged text generated so far), and finally 'result' (the final state) or 'error' (the exception).
+
+        Args:
+            model_choice (str): The name of the selected model.
+            input_text (str): The text to tag.
+            **kwargs: Options passed on to tag_pii_elements.
+
+        Yields:
+            Dict: The graph events.
+        """
+        events = queue.Queue()
+        done = object()
+
+        def run():
+            try:
+                events.put({"event": "result", "state": self.tag_pii_elements(model_choice, input_text,
+                                                                               event_sink=events.put, **kwargs)})
+            except Exception as e:
+                events.put({"event": "error", "error": e})
+            finally:
+                events.put(done)
+
+        threading.Thread(target=run, name="pii-tagger-stream", daemon=True).start()
+        while True:
+            event = events.get()
+            if event is done:
+                return
+            yield event
+
+    async def astream_pii_elements(self, model_choice, input_text, **kwargs) -> AsyncIterator[Dict]:
+        """
+        Async version of stream_pii_elements.
+
+        Args:
+            model_choice (str): The name of the selected model.
+            input_text (str): The text to tag.
+            **kwargs: Options passed on to atag_pii_elements.
+
+        Yields:
+            Dict: The graph events.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        done = object()
+
+        def sink(event: Dict) -> None:
+            # sync nodes may run in executor threads, so hand events over to the loop thread-safely
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        async def run():
+            try:
+                state = await self.atag_pii_elements(model_choice, input_text, event_sink=sink, **kwargs)
+                sink({"event": "result", "state": state})
+            except Exception as e:
+                sink({"event": "error", "error": e})
+            finally:
+                sink(done)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await events.get()
+                if event is done:
+                    return
+                yield event
+        finally:
+            task.cancel()
+
+    def _graph_input(self, model_choice, input_text, reflection_mode, max_reflections, output_mode, rules_mode,
+                     engine) -> Tuple[Dict, Optional[str]]:
+        """
+        Validates the tagging options and builds the graph input and cache key.
+
+        Returns:
+            Tuple[Dict, Optional[str]]: The graph input, and the cache key or None without a cache.
+        """
+        if reflection_mode not in REFLECTION_MODES:
+            raise ValueError(f"reflection_mode must be one of {REFLECTION_MODES}, got '{reflection_mode}'")
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"output_mode must be one of {OUTPUT_MODES}, got '{output_mode}'")
+        if rules_mode not in RULES_MODES:
+            raise ValueError(f"rules_mode must be one of {RULES_MODES}, got '{rules_mode}'")
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, got '{engine}'")
         input = {
             "original_text": input_text,
-            "model_choice": model_choice
+            "model_choice": model_choice,
+            "reflection_mode": reflection_mode,
+            "max_reflections": max_reflections,
+            "output_mode": output_mode,
+            "rules_mode": rules_mode,
+            "engine": engine
+        }
+        key = None
+        if self.cache is not None:
+            key = cache_key(input_text, model_choice, reflection_mode=reflection_mode, max_reflections=max_reflections,
+                            output_mode=output_mode, rules_mode=rules_mode, engine=engine)
+        return input, key
+
+    def _cached_response(self, input: Dict, key: Optional[str]) -> Optional[Dict]:
+        """
+        Looks up a cached result for the graph input.
+
+        Entries are shared by copies of a text that differ only in line endings, Unicode form or surrounding
+        whitespace, so a result cached for another copy is re-rendered against this input's own text. If any of
+        its tags cannot be placed in this text, the lookup counts as a miss.
+
+        Args:
+            input (Dict): The graph input.
+            key (Optional[str]): The cache key, or None without a cache.
+
+        Returns:
+            Optional[Dict]: A response shaped like the final graph state, or None on a miss.
+        """
+        if key is None:
+            return None
+        transformed_data = self.cache.get(key)
+        input_text = input["original_text"]
+        if transformed_data is not None and strip_tags(transformed_data.tagged_text or "") != input_text:
+            tagged_text = transformed_data.tagged_text or ""
+            spans = [span for span in extract_spans(tagged_text, input_text) if span[2] in Identifiers.__fields__]
+            if len(merge_spans(spans)) == len(span_pattern.findall(tagged_text)):
+                transformed_data = self._from_spans(merge_spans(spans), input_text)
+            else:
+                transformed_data = None
+        if transformed_data is None:
+            metrics.increment("pii_cache_requests_total", result="miss")
+            return None
+        metrics.increment("pii_cache_requests_total", result="hit")
+        return {
+            **input,
+            "transformed_data": transformed_data,
+            "defects": validate(transformed_data, input["original_text"]),
+            "reflection_rounds": 0,
+            "cache_hit": True
+        }
+
+    def _store_response(self, response: Dict, key: Optional[str], seconds: float) -> Dict:
+        """
+        Records metrics for and caches the result of a graph run.
+
+        Args:
+            response (Dict): The final graph state.
+            key (Optional[str]): The cache key, or None without a cache.
+            seconds (float): The wall time of the graph run.
+
+        Returns:
+            Dict: The final graph state with cache_hit set.
+        """
+        model_choice = response["model_choice"]
+        metrics.observe("pii_tag_seconds", seconds, model=model_choice)
+        metrics.increment("pii_reflection_rounds_total", response.get("reflection_rounds", 0), model=model_choice)
+        metrics.increment("pii_defects_total", len(response["defects"]), model=model_choice)
+        # results with defects are not cached so a later call can do better
+        if key is not None and not response["defects"]:
+            self.cache.put(key, response["transformed_data"])
+        return {**response, "cache_hit": False}
+
+    def _escalation_reason(self, response: Dict) -> Optional[str]:
+        """
+        Determines whether a cascade result should be escalated to the next, stronger model.
+
+        Args:
+            response (Dict): The final state of tag_pii_elements.
+
+        Returns:
+            Optional[str]: 'defects' if local validation still fails, 'rules_disagree' if the rules find emails,
+                phones or zip codes the model left untagged, or None to accept the result. Ambiguous state and
+                country matches are not used, since the model is right to leave names like Virginia untagged.
+        """
+        if response["defects"]:
+            return "defects"
+        text = response["original_text"]
+        spans = extract_spans(response["transformed_data"].tagged_text or "", text)
+        # a rule span overlapping no tagged span was missed by the model
+        if len(overlay_spans(spans, detect_entities(text, types=prepass_types))) > len(spans):
+            return "rules_disagree"
+        return None
+
+    def tag_pii_elements_cascade(self, models: Sequence[str], input_text, **kwargs) -> Dict:
+        """
+        Transforms PII with the first, cheapest model, escalating to the next model only when the result fails
+        local validation or the local rules find emails, phones or zip codes it left untagged.
+
+        Args:
+            models (Sequence[str]): The model choices to try, cheapest first, e.g. default_cascade.
+            input_text (str): The text to tag.
+            **kwargs: Options passed on to tag_pii_elements.
+
+        Returns:
+            Dict: The final state of the accepted, or last, model's run, with cascade listing the model choices
+                tried and escalation_reasons the reason each was escalated from.
+        """
+        tried, reasons = [], []
+        for model_choice in models:
+            response = self.tag_pii_elements(model_choice, input_text, **kwargs)
+            tried.append(model_choice)
+            if model_choice == models[-1]:
+                break
+            reason = self._escalation_reason(response)
+            metrics.increment("pii_cascade_results_total", model=model_choice,
+                              result="escalated" if reason else "accepted", reason=reason or "none")
+            if reason is None:
+                break
+            logger.info("escalating from %s: %s", model_choice, reason)
+            reasons.append(reason)
+        return {**response, "cascade": tried, "escalation_reasons": reasons}
+
+    def tag_pii_elements_chunked(self, model_choice, input_text, max_chars: int = 4000, overlap: int = 200,
+                                 max_workers: int = 4, models: Optional[Sequence[str]] = None, **kwargs) -> Dict:
+        """
+        Transforms PII in long input text by tagging overlapping chunks concurrently and merging the results.
+
+        Args:
+            model_choice (str): The name of the selected model.
+            input_text (str): The text to tag.
+            max_chars (int): The maximum number of characters per chunk.
+            overlap (int): The number of characters shared by consecutive chunks.
+            max_workers (int): The maximum number of chunks tagged concurrently.
+            models (Optional[Sequence[str]]): If set, each chunk is tagged with tag_pii_elements_cascade over these
+                model choices instead of with model_choice, so only failing chunks are escalated.
+            **kwargs: Reflection policy passed on to tag_pii_elements.
+
+        Returns:
+            Dict: The merged state with transformed_data, defects, reflection_rounds and chunks, and with models
+                set, escalated_chunks.
+        """
+        def tag(text):
+            if models:
+                return self.tag_pii_elements_cascade(models, text, **kwargs)
+            return self.tag_pii_elements(model_choice, text, **kwargs)
+
+        chunks = split_text(input_text, max_chars=max_chars, overlap=overlap)
+        if len(chunks) <= 1:
+            response = tag(input_text)
+            if models:
+                response["escalated_chunks"] = int(len(response["cascade"]) > 1)
+            return {**response, "chunks": 1}
+
+        def tag_chunk(chunk):
+            start, end = chunk
+            return tag(input_text[start:end])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(executor.map(tag_chunk, chunks))
+
+        spans = []
+        for (start, end), response in zip(chunks, responses):
+            tagged_text = response["transformed_data"].tagged_text or ""
+            spans.extend((start + s, start + e, tag) for s, e, tag in extract_spans(tagged_text, input_text[start:end])
+                         if tag in Identifiers.__fields__)
+        transformed_data = self._from_spans(merge_spans(spans), input_text)
+        merged = {
+            "original_text": input_text,
+            "model_choice": model_choice,
+            "transformed_data": transformed_data,
+            "defects": validate(transformed_data, input_text),
+            "reflection_rounds": sum(response["reflection_rounds"] for response in responses),
+            "chunks": len(chunks)
         }
-        response = self.wf.invoke(input)
-        return response
+        if models:
+            merged["escalated_chunks"] = sum(len(response["cascade"]) > 1 for response in responses)
+        return merged
+
+
+    def tag_pii_elements_packed(self, model_choice, input_texts: List[str], max_items: int = 20,
+                                max_chars: int = 4000, max_workers: int = 4, **kwargs) -> List[Dict]:
+        """
+        Transforms PII in many short input texts, tagging up to max_items texts per LLM call.
+
+        Texts are packed with delimited IDs into one prompt and the LLM returns one TransformedData per ID, so the
+        prompt overhead and round trip are shared by the texts of a pack. Results are validated per text, and texts
+        that are missing from the response, fail validation, or whose pack fails to parse are tagged on their own
+        with tag_pii_elements, which applies the usual repair. Texts longer than max_chars, and options the packed
+        prompt does not cover (reflection_mode 'always', spans output, rules or local engines), are tagged on their
+        own as well. Other errors of a pack call, such as rate limits and timeouts, are raised so the caller can back
+        off and retry instead of turning into one call per text.
+
+        Args:
+            model_choice (str): The name of the selected model.
+            input_texts (List[str]): The texts to tag.
+            max_items (int): The maximum number of texts per LLM call.
+            max_chars (int): The maximum number of characters of texts per LLM call.
+            max_workers (int): The maximum number of packs and fallback texts tagged concurrently.
+            **kwargs: Options passed on to tag_pii_elements.
+
+        Returns:
+            List[Dict]: One result per text, shaped like the final state of tag_pii_elements, with packed set to
+                whether the text was tagged in a pack.
+        """
+        results: List[Optional[Dict]] = [None] * len(input_texts)
+        reflection_mode = kwargs.get("reflection_mode", "on_failure")
+        max_reflections = kwargs.get("max_reflections", 1)
+        packable = (reflection_mode != "always" and kwargs.get("output_mode", "tagged") == "tagged"
+                    and kwargs.get("rules_mode", "off") == "off" and kwargs.get("engine", "llm") == "llm")
+
+        def graph_input(i: int) -> Tuple[Dict, Optional[str]]:
+            return self._graph_input(model_choice, input_texts[i], reflection_mode, max_reflections, "tagged", "off", "llm")
+
+        packs: List[List[int]] = []
+        singles: List[int] = []
+        size = 0
+        for i, input_text in enumerate(input_texts):
+            if not packable or len(input_text) > max_chars:
+                singles.append(i)
+                continue
+            cached = self._cached_response(*graph_input(i))
+            if cached is not None:
+                results[i] = {**cached, "packed": False}
+                continue
+            if not packs or len(packs[-1]) >= max_items or size + len(input_text) > max_chars:
+                packs.append([])
+                size = 0
+            packs[-1].append(i)
+            size += len(input_text)
+
+        def tag_pack(pack: List[int]) -> List[int]:
+            texts = [input_texts[i] for i in pack]
+            prompt = ChatPromptTemplate.from_messages(messages=pii_packed_prompt_template)
+            chain = prompt | self._model_from_selection(model_choice) | self.packed_parser
+            start = time.perf_counter()
+            try:
+                response = chain.invoke({"texts": pack_texts(texts), "entity_types": self._entity_types(),
+                                         "format_instructions": self.packed_parser.get_format_instructions()},
+                                        config={"callbacks": [TokenUsageHandler(model_choice, node="packed")]})
+            except (OutputParserException, ValidationError) as e:
+                # other errors (rate limits, timeouts) propagate to the caller's retry rather than multiplying into
+                # one call per text
+                logger.warning("packed response for %d texts did not parse, tagging them one by one: %s", len(pack), e)
+                response = PackedOutput(items=[])
+            # every text of the pack is charged an equal share of the call
+            seconds = (time.perf_counter() - start) / len(pack)
+            items = {item.id.strip(): item for item in response.items}
+            failed = []
+            for n, i in enumerate(pack):
+                item = items.get(str(n))
+                transformed_data = TransformedData(identifiers=item.identifiers, tagged_text=item.tagged_text) if item else None
+                defects = validate(transformed_data, input_texts[i])
+                if defects:
+                    failed.append(i)
+                    continue
+                input, key = graph_input(i)
+                state = {**input, "transformed_data": transformed_data, "defects": defects, "reflection_rounds": 0}
+                results[i] = {**self._store_response(state, key, seconds), "packed": True}
+            metrics.increment("pii_packed_texts_total", len(pack) - len(failed), model=model_choice, result="packed")
+            metrics.increment("pii_packed_texts_total", len(failed), model=model_choice, result="fallback")
+            return failed
+
+        def tag_single(i: int) -> None:
+            results[i] = {**self.tag_pii_elements(model_choice, input_texts[i], **kwargs), "packed": False}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for failed in executor.map(tag_pack, packs):
+                singles.extend(failed)
+            list(executor.map(tag_single, singles))
+        return results
+
+
+    def tag_pii_elements_local(self, input_texts: List[str], batch_size: int = 256, n_process: int = 1) -> List[Dict]:
+        """
+        Transforms PII in many input texts with spaCy NER and rules, batched through nlp.pipe, without the LLM.
+
+        Args:
+            input_texts (List[str]): The texts to tag.
+            batch_size (int): The number of texts per spaCy batch.
+            n_process (int): The number of spaCy worker processes.
+
+        Returns:
+            List[Dict]: One result per text, shaped like the final state of tag_pii_elements.
+        """
+        results = []
+        for input_text, spans in zip(input_texts, ner_spans_batch(input_texts, batch_size=batch_size, n_process=n_process)):
+            transformed_data = self._from_spans(overlay_spans(detect_entities(input_text), spans), input_text)
+            results.append({
+                "original_text": input_text,
+                "engine": "local",
+                "transformed_data": transformed_data,
+                "defects": validate(transformed_data, input_text),
+                "reflection_rounds": 0
+            })
+        return results
+
+
+_tagger: PIITagger = None
+_tagger_lock = threading.Lock()
+
+
+def get_tagger() -> PIITagger:
+    """
+    Returns the process-wide PIITagger, compiling its workflow on first use.
+
+    Results are cached in memory, and in the SQLite file named by PII_CACHE_PATH if set.
+
+    Returns:
+        PIITagger: The shared tagger.
+    """
+    global _tagger
+    if _tagger is None:
+        with _tagger_lock:
+            if _tagger is None:
+                _tagger = PIITagger(cache=ResultCache(
+                    max_entries=int(os.environ.get("PII_CACHE_ENTRIES", "1024")),
+                    path=os.environ.get("PII_CACHE_PATH")
+                ))
+    return _tagger
 
 
 if __name__ == "__main__":
-    transformer = PIITagger()
+    transformer = get_tagger()
     response = transformer.tag_pii_elements("GPT 3.5", "john lives in montanna, and works at CVS pharmacy.")
     print(f"response:messages\n{response['messages']}")
     
\ No newline at end of file
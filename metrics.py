@@ -0,0 +1,218 @@
+"""
+This module contains lightweight instrumentation: timings and counters aggregated in memory and forwarded to
+pluggable sinks (logging, JSON lines), with export in the Prometheus text format to a file written at exit
+(PII_METRICS_PROMETHEUS) or on demand.
+"""
+
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger("pii_assistant.metrics")
+
+# An aggregated metric is keyed by (name, sorted label items)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class LoggingSink:
+    def __init__(self, level: int = logging.INFO):
+        """
+        Logs every metric event.
+
+        Args:
+            level (int): The logging level.
+        """
+        self.level = level
+
+    def __call__(self, event: Dict) -> None:
+        logger.log(self.level, "%s %s=%s", event["metric"], event["labels"], event["value"])
+
+
+class JsonLinesSink:
+    def __init__(self, path: str):
+        """
+        Appends every metric event to a JSON lines file.
+
+        Args:
+            path (str): The JSON lines file.
+        """
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Creates an empty collector without sinks.
+        """
+        self._timings: Dict[MetricKey, List[float]] = {}
+        self._counters: Dict[MetricKey, float] = {}
+        self._sinks: List[Callable[[Dict], None]] = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: Callable[[Dict], None]) -> None:
+        """
+        Registers a callable receiving every metric event.
+
+        Args:
+            sink (Callable[[Dict], None]): The sink, e.g. LoggingSink or JsonLinesSink.
+        """
+        self._sinks.append(sink)
+
+    def _emit(self, kind: str, name: str, value: float, labels: Dict[str, Any]) -> None:
+        event = {"metric": name, "type": kind, "value": value, "labels": labels, "ts": time.time()}
+        for sink in self._sinks:
+            sink(event)
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """
+        Records a duration.
+
+        Args:
+            name (str): The metric name.
+            seconds (float): The duration in seconds.
+            **labels: Labels such as node or model.
+        """
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            # [count, sum, max]
+            stats = self._timings.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        self._emit("timing", name, seconds, labels)
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Adds to a counter.
+
+        Args:
+            name (str): The metric name.
+            value (float): The amount to add.
+            **labels: Labels such as model or result.
+        """
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._emit("counter", name, value, labels)
+
+    def timed(self, name: str, **labels) -> Callable:
+        """
+        Decorator recording the wall time of every call of a function.
+
+        Args:
+            name (str): The metric name.
+            **labels: Labels attached to every observation.
+
+        Returns:
+            Callable: The decorator.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def total(self, name: str, **labels) -> float:
+        """
+        Sums a counter over every label set matching the given labels.
+
+        Args:
+            name (str): The metric name.
+            **labels: Labels the counted label sets must have.
+
+        Returns:
+            float: The summed counter, 0 if nothing was counted.
+        """
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return sum(value for (metric, key), value in self._counters.items()
+                       if metric == name and wanted <= set(key))
+
+    def summary(self) -> List[Dict]:
+        """
+        Summarizes every metric, e.g. for display in the UI.
+
+        Returns:
+            List[Dict]: One row per metric and label set.
+        """
+        with self._lock:
+            rows = [{"metric": name, "labels": dict(labels), "count": stats[0], "total": round(stats[1], 6),
+                     "mean": round(stats[1] / stats[0], 6), "max": round(stats[2], 6)}
+                    for (name, labels), stats in self._timings.items()]
+            rows += [{"metric": name, "labels": dict(labels), "total": value}
+                     for (name, labels), value in self._counters.items()]
+        return sorted(rows, key=lambda row: (row["metric"], str(row["labels"])))
+
+    def prometheus_text(self) -> str:
+        """
+        Exports every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: Timings as summaries with _count and _sum series, and counters.
+        """
+        def series(name, labels, value):
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({key[0] for key in self._timings}):
+                lines.append(f"# TYPE {name} summary")
+                for (metric, labels), stats in sorted(self._timings.items()):
+                    if metric == name:
+                        lines.append(series(f"{name}_count", labels, stats[0]))
+                        lines.append(series(f"{name}_sum", labels, stats[1]))
+            for name in sorted({key[0] for key in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(series(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes prometheus_text to a file, e.g. for the node_exporter textfile collector.
+
+        The text is written to a temporary file that replaces path, so a scrape never reads a partial file.
+
+        Args:
+            path (str): The file, conventionally ending in .prom.
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+    def reset(self) -> None:
+        """
+        Clears every aggregated metric.
+        """
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+
+
+# Process-wide collector used by the tagger, mask_utils and the batch runner
+metrics = Metrics()
+if os.environ.get("PII_METRICS_LOG"):
+    metrics.add_sink(LoggingSink())
+if os.environ.get("PII_METRICS_JSONL"):
+    metrics.add_sink(JsonLinesSink(os.environ["PII_METRICS_JSONL"]))
+if os.environ.get("PII_METRICS_PROMETHEUS"):
+    atexit.register(metrics.write_prometheus, os.environ["PII_METRICS_PROMETHEUS"])
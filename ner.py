@@ -0,0 +1,116 @@
+"""
+This module maps spaCy named entities to PII elements. spaCy is imported lazily so it stays optional.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, List
+from span_utils import Span, merge_spans
+from rules import us_states, countries
+
+# spaCy pipeline used for local tagging; override with the SPACY_MODEL environment variable
+default_model = os.environ.get("SPACY_MODEL", "en_core_web_sm")
+
+_state_names = set(us_states) | set(us_states.values())
+_country_names = set(countries)
+_word_pattern = re.compile(r'\S+')
+
+
+@lru_cache(maxsize=None)
+def load_nlp(model_name: str = default_model):
+    """
+    Loads and caches a spaCy pipeline with the components NER does not need disabled.
+
+    Args:
+        model_name (str): The name of the spaCy pipeline.
+
+    Returns:
+        spacy.language.Language: The loaded pipeline.
+    """
+    try:
+        import spacy
+    except ImportError as e:
+        raise ImportError("Local tagging requires spaCy: pip install spacy && python -m spacy download en_core_web_sm") from e
+    return spacy.load(model_name, disable=["parser", "lemmatizer"])
+
+
+def _person_spans(text: str, start: int, end: int) -> List[Span]:
+    """
+    Splits a PERSON entity into first, middle and last name spans.
+
+    Args:
+        text (str): The document text.
+        start (int): The start offset of the entity.
+        end (int): The end offset of the entity.
+
+    Returns:
+        List[Span]: The name spans.
+    """
+    words = [(m.start(), m.end()) for m in _word_pattern.finditer(text, start, end)]
+    if not words:
+        return []
+    spans = [(words[0][0], words[0][1], 'first_name')]
+    if len(words) > 2:
+        spans.append((words[1][0], words[-2][1], 'middle_name'))
+    if len(words) > 1:
+        spans.append((words[-1][0], words[-1][1], 'last_name'))
+    return spans
+
+
+def _doc_spans(doc) -> List[Span]:
+    """
+    Maps the entities of a spaCy document to PII spans.
+
+    Args:
+        doc (spacy.tokens.Doc): The processed document.
+
+    Returns:
+        List[Span]: Sorted, non-overlapping spans.
+    """
+    spans: List[Span] = []
+    for ent in doc.ents:
+        if ent.label_ == 'PERSON':
+            spans.extend(_person_spans(doc.text, ent.start_char, ent.end_char))
+        elif ent.label_ == 'ORG':
+            spans.append((ent.start_char, ent.end_char, 'company'))
+        elif ent.label_ in ('GPE', 'LOC'):
+            if ent.text in _state_names:
+                spans.append((ent.start_char, ent.end_char, 'state'))
+            elif ent.text in _country_names:
+                spans.append((ent.start_char, ent.end_char, 'country'))
+            else:
+                spans.append((ent.start_char, ent.end_char, 'city'))
+    return merge_spans(spans)
+
+
+def ner_spans(text: str, model_name: str = default_model) -> List[Span]:
+    """
+    Finds names, companies and places in text with spaCy.
+
+    Args:
+        text (str): The text to tag.
+        model_name (str): The name of the spaCy pipeline.
+
+    Returns:
+        List[Span]: Sorted, non-overlapping spans.
+    """
+    return _doc_spans(load_nlp(model_name)(text))
+
+
+def ner_spans_batch(texts: Iterable[str], model_name: str = default_model, batch_size: int = 256,
+                    n_process: int = 1) -> List[List[Span]]:
+    """
+    Finds names, companies and places in many texts with spaCy's batched nlp.pipe.
+
+    Args:
+        texts (Iterable[str]): The texts to tag.
+        model_name (str): The name of the spaCy pipeline.
+        batch_size (int): The number of texts per batch.
+        n_process (int): The number of worker processes.
+
+    Returns:
+        List[List[Span]]: The spans of each text.
+    """
+    nlp = load_nlp(model_name)
+    return [_doc_spans(doc) for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process)]
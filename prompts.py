@@ -56,10 +56,91 @@ pii_prompt_template=[
 ]
 
 
+# Maps entity types to the descriptions used when listing them in prompts
+entity_descriptions = {
+    "first_name": "first names",
+    "last_name": "last names",
+    "middle_name": "middle names",
+    "phone": "Phone Numbers",
+    "email": "Email Addresses",
+    "address_line_1": "Street Address Line 1s",
+    "address_line_2": "Street Address Line 2s",
+    "city": "Cities",
+    "zipcode": "Zip Codes",
+    "state": "States or US state codes",
+    "country": "Countries",
+    "company": "Company Names",
+}
+
+
+pii_span_prompt_template=[
+    pii_prompt_template[0],
+    ("human", dedent("""YOUR TASK:
+        Extract every occurrence of the following PII elements from TEXT and report each one with its type:
+        {entity_types}
+        Copy each value exactly as it appears in TEXT, including case and punctuation.
+        Do not repeat TEXT in your output.
+
+        TEXT:
+        {text}
+
+
+        Format your output using the format instructions.
+        FORMAT INSTRUCTIONS:
+        {format_instructions}
+        Do not escape underscores in type names in your json output.
+    """)
+    )
+]
+
+
+pii_packed_prompt_template=[
+    pii_prompt_template[0],
+    ("human", dedent("""YOUR TASK:
+        TEXTS below contains several independent texts. Each text starts with a line
+        --- BEGIN TEXT <id> ---
+        and ends with a line
+        --- END TEXT <id> ---
+        Process each text on its own, exactly as if it were the only text:
+        1. Extract every occurrence of the following PII elements from the text:
+        {entity_types}
+        2. Tag the text by adding tags for each occurrence of the above items as follows:
+        <tag>value</tag>
+        where tag is the name before the colon above, such as first_name or zipcode, and value is the value of the item.
+        For example John will be replaced by <first_name>John</first_name>
+        and 20147 will be replaced by <zipcode>20147</zipcode>
+        Otherwise the original content should be preserved including indents and line breaks.
+        Pay attention to the underscores in tag names.
+        Do not include the BEGIN TEXT and END TEXT lines in tagged_text.
+        Return one item per text, with the text's id.
+
+        TEXTS:
+        {texts}
+
+
+        Format your output using the format instructions.
+        FORMAT INSTRUCTIONS:
+        {format_instructions}
+        Do not escape underscores in names of keys in your json output.
+    """)
+    )
+]
+
+
 pii_reflect_template = dedent(
     """
     Review TransformedData and provide your recommendations. If the object satisfies all requirements in terms of content and formatting instructions, say so and 
     Format your response based on this format instructions: 
     {format_instructions}
     """
-)
\ No newline at end of file
+)
+
+
+pii_repair_template = dedent(
+    """
+    Local validation found the following defects in TransformedData:
+    {defects}
+
+    Fix these defects and return your complete output again, following the original formatting instructions.
+    """
+)
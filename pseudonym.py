@@ -0,0 +1,431 @@
+"""
+This module contains deterministic pseudonymization: each (entity type, value) pair is mapped to a fake value
+seeded by a keyed hash, so workers sharing the key agree on fakes without coordinating.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from faker import Faker
+
+# Maps entity types to the Faker provider methods generating their fake values
+faker_methods: Dict[str, Optional[str]] = {
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'middle_name': None,
+    'phone': 'phone_number',
+    'email': 'safe_email',
+    'address_line_1': 'street_address',
+    'address_line_2': 'street_address',
+    'city': 'city',
+    'state': 'state',
+    'zipcode': 'zipcode',
+    'company': 'company',
+    'country': 'country',
+}
+
+# How often a fake colliding with another value's fake is re-hashed before the collision is accepted
+max_fake_attempts = 20
+
+
+def normalize_value(value: str) -> str:
+    """
+    Normalizes a value so differently cased or spaced copies share a fake.
+
+    Args:
+        value (str): The original value.
+
+    Returns:
+        str: The case-folded value with whitespace collapsed.
+    """
+    return ' '.join(value.split()).casefold()
+
+
+class FakePool:
+    def __init__(self, size: int = 10000, seed: int = 0, locale: str = 'en_US', block_size: int = 1000):
+        """
+        Creates pools of pre-generated fake values, filled lazily per entity type.
+
+        Pools are generated block by block from the seed, so every process with the same seed
+        and size builds identical pools and can share fakes without exchanging data.
+
+        Args:
+            size (int): The number of fake values per entity type.
+            seed (int): The seed the pools are generated from.
+            locale (str): The Faker locale.
+            block_size (int): The number of values generated per seeded block.
+        """
+        self.size = size
+        self.seed = seed
+        self.locale = locale
+        self.block_size = block_size
+        self.pools: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def _generate_block(self, faker: Faker, entity: str, block: int) -> List[str]:
+        """
+        Generates one seeded block of fake values.
+
+        Args:
+            faker (Faker): The Faker instance to use.
+            entity (str): The entity type.
+            block (int): The block number.
+
+        Returns:
+            List[str]: The fake values of the block.
+        """
+        method = faker_methods[entity]
+        if method is None:
+            return [''] * self.block_size
+        digest = hashlib.sha256(f'{self.seed}\0{entity}\0{block}'.encode('utf-8')).digest()
+        faker.seed_instance(int.from_bytes(digest[:8], 'big'))
+        generate = getattr(faker, method)
+        return [generate() for _ in range(self.block_size)]
+
+    def fill(self, entity: str) -> List[str]:
+        """
+        Generates the pool of an entity type up to the pool size, if not done already.
+
+        Args:
+            entity (str): The entity type.
+
+        Returns:
+            List[str]: The pool.
+        """
+        pool = self.pools.get(entity)
+        if pool is not None and len(pool) == self.size:
+            return pool
+        with self._lock:
+            pool = self.pools.get(entity, [])
+            if len(pool) >= self.size:
+                pool = pool[:self.size]
+            else:
+                # a partly used last block is regenerated in full, so the pool is the prefix of the block sequence
+                pool = pool[:len(pool) // self.block_size * self.block_size]
+                faker = Faker(self.locale)
+                while len(pool) < self.size:
+                    pool.extend(self._generate_block(faker, entity, len(pool) // self.block_size))
+            self.pools[entity] = pool = pool[:self.size]
+        return pool
+
+    def refill(self, size: int) -> None:
+        """
+        Resizes every pool. The result matches a pool created with the new size, but fakes drawn
+        before and after refilling differ, so refill between runs, or persist mappings in a MappingStore.
+
+        Args:
+            size (int): The new number of fake values per entity type.
+        """
+        self.size = size
+        for entity in list(self.pools):
+            self.fill(entity)
+
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Fills the pools of every entity type, optionally in a background thread.
+
+        Args:
+            background (bool): Whether to fill the pools in a daemon thread.
+
+        Returns:
+            Optional[threading.Thread]: The thread filling the pools, if running in the background.
+        """
+        def fill_all():
+            for entity in faker_methods:
+                self.fill(entity)
+        if not background:
+            fill_all()
+            return None
+        thread = threading.Thread(target=fill_all, name="fake-pool-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def lookup(self, entity: str, digest: bytes) -> str:
+        """
+        Picks the fake value indexed by a hash digest.
+
+        Args:
+            entity (str): The entity type.
+            digest (bytes): The keyed hash of the original value.
+
+        Returns:
+            str: The fake value.
+        """
+        pool = self.fill(entity)
+        return pool[int.from_bytes(digest[8:16], 'big') % len(pool)]
+
+    def save(self, path: str) -> None:
+        """
+        Writes the filled pools to a JSON file so other worker processes can load them.
+
+        Args:
+            path (str): The JSON file.
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"size": self.size, "seed": self.seed, "locale": self.locale,
+                       "block_size": self.block_size, "pools": self.pools}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "FakePool":
+        """
+        Reads pools written by save.
+
+        Args:
+            path (str): The JSON file.
+
+        Returns:
+            FakePool: The loaded pools.
+        """
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        pool = cls(size=data["size"], seed=data["seed"], locale=data["locale"], block_size=data["block_size"])
+        pool.pools = data["pools"]
+        return pool
+
+
+class MappingStore:
+    def __init__(self, path: str):
+        """
+        Opens or creates a SQLite table of original to fake value mappings.
+
+        Args:
+            path (str): The SQLite file, or ':memory:'.
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mappings "
+            "(entity TEXT, normalized TEXT, original TEXT, fake TEXT, PRIMARY KEY (entity, normalized))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS mappings_fake ON mappings (fake)")
+        self._db.commit()
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        """
+        Looks up the fakes of many (entity, normalized value) pairs.
+
+        Args:
+            keys (List[Tuple[str, str]]): The pairs to look up.
+
+        Returns:
+            Dict[Tuple[str, str], str]: The fakes found, keyed by pair.
+        """
+        found: Dict[Tuple[str, str], str] = {}
+        with self._lock:
+            # stay well under SQLite's limit on bound parameters
+            for i in range(0, len(keys), 400):
+                batch = keys[i:i + 400]
+                where = " OR ".join(["(entity = ? AND normalized = ?)"] * len(batch))
+                params = [item for key in batch for item in key]
+                for entity, normalized, fake in self._db.execute(
+                        f"SELECT entity, normalized, fake FROM mappings WHERE {where}", params):
+                    found[(entity, normalized)] = fake
+        return found
+
+    def put_many(self, rows: Iterable[Tuple[str, str, str, str]]) -> None:
+        """
+        Stores (entity, normalized value, original value, fake) rows, keeping existing mappings.
+
+        Args:
+            rows (Iterable[Tuple[str, str, str, str]]): The mappings to store.
+        """
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO mappings VALUES (?, ?, ?, ?)", list(rows))
+            self._db.commit()
+
+    def find_fakes(self, pairs: List[Tuple[str, str]]) -> set:
+        """
+        Finds which (entity, fake) pairs are already used by a stored mapping.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The pairs to look up.
+
+        Returns:
+            set: The pairs in use.
+        """
+        found = set()
+        with self._lock:
+            for i in range(0, len(pairs), 400):
+                batch = pairs[i:i + 400]
+                where = " OR ".join(["(entity = ? AND fake = ?)"] * len(batch))
+                params = [item for pair in batch for item in pair]
+                found.update(self._db.execute(f"SELECT entity, fake FROM mappings WHERE {where}", params))
+        return found
+
+    def reidentify(self, fake: str, entity: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Finds the original values masked by a fake value, for authorized re-identification.
+
+        Fakes are kept unique per entity type where the fake value space allows it, so a fake maps back to
+        one original. Small spaces such as states (50) or en_US first names (about 700) run out of distinct fakes,
+        and then several originals match.
+
+        Args:
+            fake (str): The fake value.
+            entity (Optional[str]): Restricts the lookup to one entity type.
+
+        Returns:
+            List[Tuple[str, str]]: The (entity, original value) pairs.
+        """
+        query, params = "SELECT entity, original FROM mappings WHERE fake = ?", [fake]
+        if entity is not None:
+            query, params = query + " AND entity = ?", params + [entity]
+        with self._lock:
+            return list(self._db.execute(query, params))
+
+
+class Pseudonymizer:
+    def __init__(self, key: bytes, store: Optional[MappingStore] = None, locale: str = 'en_US',
+                 pool: Optional[FakePool] = None):
+        """
+        Creates the pseudonymizer.
+
+        Args:
+            key (bytes): The secret key seeding the fakes; workers must share it to agree on fakes.
+            store (Optional[MappingStore]): Persists mappings for bulk lookups and re-identification.
+            locale (str): The Faker locale.
+            pool (Optional[FakePool]): Pre-generated fakes to index into instead of running Faker per value.
+                Size the pool well above the number of distinct values, so collisions stay rare.
+
+        Distinct values whose fakes collide are re-hashed with a counter, against the fakes of the same call and,
+        with a store, every stored fake. Without a store, collisions are only resolved within one call, so a
+        value's fake can depend on the other values masked with it, and there is no reverse lookup.
+        """
+        self.key = key
+        self.store = store
+        self.locale = locale
+        self.pool = pool
+        self._local = threading.local()
+
+    def _faker(self) -> Faker:
+        """
+        Returns this thread's Faker instance, as seeding is not thread-safe.
+
+        Returns:
+            Faker: The thread-local Faker.
+        """
+        faker = getattr(self._local, 'faker', None)
+        if faker is None:
+            faker = self._local.faker = Faker(self.locale)
+        return faker
+
+    def _generate(self, entity: str, normalized: str, attempt: int = 0) -> str:
+        """
+        Generates the fake value for a normalized value, seeded by its keyed hash.
+
+        Args:
+            entity (str): The entity type.
+            normalized (str): The normalized original value.
+            attempt (int): The collision counter, re-hashing the value to get a different fake.
+
+        Returns:
+            str: The fake value.
+        """
+        method = faker_methods[entity]
+        if method is None:
+            return ''
+        message = f'{entity}\0{normalized}' + (f'\0{attempt}' if attempt else '')
+        digest = hmac.new(self.key, message.encode('utf-8'), hashlib.sha256).digest()
+        if self.pool is not None:
+            return self.pool.lookup(entity, digest)
+        faker = self._faker()
+        faker.seed_instance(int.from_bytes(digest[:8], 'big'))
+        return getattr(faker, method)()
+
+    def pseudonymize(self, entity: str, value: str) -> str:
+        """
+        Returns the fake value for a single value.
+
+        Args:
+            entity (str): The entity type.
+            value (str): The original value.
+
+        Returns:
+            str: The fake value.
+        """
+        return self.pseudonymize_many([(entity, value)])[(entity, value)]
+
+    def pseudonymize_many(self, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        """
+        Returns the fake values for many (entity, value) pairs, with bulk store lookups.
+
+        Distinct values get distinct fakes where possible; see the class docstring.
+
+        Args:
+            pairs (Iterable[Tuple[str, str]]): The (entity, original value) pairs.
+
+        Returns:
+            Dict[Tuple[str, str], str]: The fake values keyed by pair.
+        """
+        normalized = {(entity, value): (entity, normalize_value(value)) for entity, value in pairs}
+        keys = list(dict.fromkeys(normalized.values()))
+        fakes = self.store.get_many(keys) if self.store is not None else {}
+        taken = {(key[0], fake) for key, fake in fakes.items()}
+        pending = [key for key in keys if key not in fakes]
+        new_keys = set(pending)
+        attempt = 0
+        while pending:
+            candidates = {key: self._generate(*key, attempt=attempt) for key in pending}
+            stored = set()
+            if self.store is not None:
+                stored = self.store.find_fakes(list({(key[0], fake) for key, fake in candidates.items() if fake}))
+            retry = []
+            for key in pending:
+                fake = candidates[key]
+                if fake and attempt + 1 < max_fake_attempts and ((key[0], fake) in taken or (key[0], fake) in stored):
+                    retry.append(key)
+                    continue
+                fakes[key] = fake
+                taken.add((key[0], fake))
+            pending = retry
+            attempt += 1
+        new_rows = []
+        for pair, key in normalized.items():
+            if key in new_keys:
+                new_keys.discard(key)
+                new_rows.append((key[0], key[1], pair[1], fakes[key]))
+        if self.store is not None and new_rows:
+            self.store.put_many(new_rows)
+        return {pair: fakes[key] for pair, key in normalized.items()}
+
+
+_default_pseudonymizer: Optional[Pseudonymizer] = None
+_default_lock = threading.Lock()
+
+
+def get_pseudonymizer() -> Pseudonymizer:
+    """
+    Returns the process-wide pseudonymizer.
+
+    The key is read from PII_PSEUDONYM_KEY, or generated randomly so fakes are only consistent within the
+    process. Mappings are persisted to the SQLite file named by PII_PSEUDONYM_STORE if set. If PII_FAKE_POOL
+    is set to a file written by FakePool.save, or PII_FAKE_POOL_SIZE to a positive size, fakes are drawn from
+    pre-generated pools warmed up in the background.
+
+    Returns:
+        Pseudonymizer: The shared pseudonymizer.
+    """
+    global _default_pseudonymizer
+    if _default_pseudonymizer is None:
+        with _default_lock:
+            if _default_pseudonymizer is None:
+                key = os.environ.get("PII_PSEUDONYM_KEY")
+                store_path = os.environ.get("PII_PSEUDONYM_STORE")
+                pool_path = os.environ.get("PII_FAKE_POOL")
+                pool_size = int(os.environ.get("PII_FAKE_POOL_SIZE", "0"))
+                pool = None
+                if pool_path:
+                    pool = FakePool.load(pool_path)
+                elif pool_size > 0:
+                    pool = FakePool(size=pool_size)
+                    pool.warm_up(background=True)
+                _default_pseudonymizer = Pseudonymizer(
+                    key=key.encode('utf-8') if key else os.urandom(32),
+                    store=MappingStore(store_path) if store_path else None,
+                    pool=pool
+                )
+    return _default_pseudonymizer
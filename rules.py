@@ -0,0 +1,114 @@
+"""
+This module contains a local, rule-based detector for emails, phones and zip codes, and gazetteer lookups for states and countries.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Pattern
+from span_utils import Span, merge_spans
+
+us_states: Dict[str, str] = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
+    'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
+    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
+    'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri',
+    'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey',
+    'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
+    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+    'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
+    'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
+    'DC': 'District of Columbia', 'PR': 'Puerto Rico',
+}
+
+countries: List[str] = [
+    'Afghanistan', 'Albania', 'Algeria', 'Argentina', 'Armenia', 'Australia', 'Austria', 'Azerbaijan',
+    'Bahamas', 'Bahrain', 'Bangladesh', 'Belarus', 'Belgium', 'Bolivia', 'Bosnia and Herzegovina', 'Brazil',
+    'Bulgaria', 'Cambodia', 'Cameroon', 'Canada', 'Chile', 'China', 'Colombia', 'Costa Rica', 'Croatia',
+    'Cuba', 'Cyprus', 'Czech Republic', 'Denmark', 'Dominican Republic', 'Ecuador', 'Egypt', 'El Salvador',
+    'Estonia', 'Ethiopia', 'Finland', 'France', 'Germany', 'Ghana', 'Greece', 'Guatemala', 'Honduras',
+    'Hong Kong', 'Hungary', 'Iceland', 'India', 'Indonesia', 'Iran', 'Iraq', 'Ireland', 'Israel', 'Italy',
+    'Jamaica', 'Japan', 'Jordan', 'Kazakhstan', 'Kenya', 'Kuwait', 'Latvia', 'Lebanon', 'Lithuania',
+    'Luxembourg', 'Malaysia', 'Mexico', 'Morocco', 'Nepal', 'Netherlands', 'New Zealand', 'Nicaragua',
+    'Nigeria', 'North Korea', 'Norway', 'Pakistan', 'Panama', 'Paraguay', 'Peru', 'Philippines', 'Poland',
+    'Portugal', 'Qatar', 'Romania', 'Russia', 'Saudi Arabia', 'Serbia', 'Singapore', 'Slovakia', 'Slovenia',
+    'South Africa', 'South Korea', 'Spain', 'Sri Lanka', 'Sweden', 'Switzerland', 'Syria', 'Taiwan',
+    'Tanzania', 'Thailand', 'Tunisia', 'Turkey', 'Uganda', 'Ukraine', 'United Arab Emirates',
+    'United Kingdom', 'United States', 'United States of America', 'Uruguay', 'Venezuela', 'Vietnam',
+    'Zambia', 'Zimbabwe', 'USA', 'UK',
+]
+
+# Maps entity types to the names looked up verbatim in text
+default_gazetteers: Dict[str, List[str]] = {
+    'state': list(us_states.values()),
+    'country': countries,
+}
+
+# Entity types the detector can find; everything else is left to the LLM
+rule_types = ('email', 'phone', 'zipcode', 'state', 'country')
+
+# Entity types found by unambiguous patterns, safe to take precedence over the LLM. State and country
+# names and bare state codes double as person names and words ("Virginia Jordan called, OK?").
+prepass_types = ('email', 'phone', 'zipcode')
+
+_state_codes = '|'.join(us_states)
+email_pattern = re.compile(r'(?<![\w.+-])[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}(?!\w)')
+phone_pattern = re.compile(
+    r'(?<![\w+])(?:\+?1[\s.-]?)?(?:\(\d{3}\)\s?|\d{3}[\s.-])\d{3}[\s.-]\d{4}(?![\w-])'
+    r'|(?<![\w+])\+\d{1,3}(?:[\s.-]\d{1,4}){2,5}(?![\w-])'
+)
+zip_plus_four_pattern = re.compile(r'(?<![\w-])\d{5}-\d{4}(?![\w-])')
+# A state code or name followed by a zip code, as in "Ashburn, VA 20147"
+state_zip_pattern = re.compile(
+    rf'(?<![\w-])(?P<state>{_state_codes}|' + '|'.join(re.escape(name) for name in us_states.values())
+    + r'),?\s+(?P<zipcode>\d{5}(?:-\d{4})?)(?![\w-])'
+)
+# A state code after a comma, as in "Chicago, IL"
+state_code_pattern = re.compile(rf'(?<=,\s)(?:{_state_codes})(?![\w-])')
+
+
+def compile_gazetteers(gazetteers: Dict[str, Iterable[str]]) -> Dict[str, Pattern]:
+    """
+    Compiles one case-sensitive, word-bounded alternation per gazetteer.
+
+    Args:
+        gazetteers (Dict[str, Iterable[str]]): A dictionary mapping entity types to names.
+
+    Returns:
+        Dict[str, Pattern]: A dictionary mapping entity types to compiled patterns.
+    """
+    patterns = {}
+    for entity, names in gazetteers.items():
+        names = sorted(set(names), key=len, reverse=True)
+        if names:
+            patterns[entity] = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(name) for name in names) + r')(?!\w)')
+    return patterns
+
+
+default_gazetteer_patterns = compile_gazetteers(default_gazetteers)
+
+
+def detect_entities(text: str, gazetteers: Optional[Dict[str, Pattern]] = default_gazetteer_patterns,
+                    types: Iterable[str] = rule_types) -> List[Span]:
+    """
+    Finds emails, phone numbers, zip codes, states and countries in text using compiled patterns.
+
+    Args:
+        text (str): The text to scan.
+        gazetteers (Optional[Dict[str, Pattern]]): Compiled gazetteer patterns, or None to skip gazetteer lookups.
+        types (Iterable[str]): The entity types to find, e.g. prepass_types for the unambiguous ones only.
+
+    Returns:
+        List[Span]: Sorted, non-overlapping spans.
+    """
+    spans: List[Span] = []
+    spans.extend((m.start(), m.end(), 'email') for m in email_pattern.finditer(text))
+    spans.extend((m.start(), m.end(), 'phone') for m in phone_pattern.finditer(text))
+    for m in state_zip_pattern.finditer(text):
+        spans.append((m.start('state'), m.end('state'), 'state'))
+        spans.append((m.start('zipcode'), m.end('zipcode'), 'zipcode'))
+    spans.extend((m.start(), m.end(), 'zipcode') for m in zip_plus_four_pattern.finditer(text))
+    spans.extend((m.start(), m.end(), 'state') for m in state_code_pattern.finditer(text))
+    for entity, pattern in (gazetteers or {}).items():
+        spans.extend((m.start(), m.end(), entity) for m in pattern.finditer(text))
+    types = set(types)
+    return merge_spans([span for span in spans if span[2] in types])
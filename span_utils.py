@@ -0,0 +1,153 @@
+"""
+This module contains helpers to convert between tagged text and character spans of the original text.
+"""
+
+import re
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+# A span is (start, end, tag) in original text coordinates
+Span = Tuple[int, int, str]
+
+span_pattern = re.compile(r'<([a-z_0-9]+)>(.*?)</\1>', re.DOTALL)
+
+
+def extract_spans(tagged_text: str, text: str) -> List[Span]:
+    """
+    Locates the tagged values of tagged_text in the untagged text.
+
+    Values are searched for in order, starting after the previous match, so small
+    differences between the tagged text and the original text do not shift later spans.
+
+    Args:
+        tagged_text (str): The text with PII tagged.
+        text (str): The original text.
+
+    Returns:
+        List[Span]: The spans found in text.
+    """
+    spans: List[Span] = []
+    cursor = 0
+    for match in span_pattern.finditer(tagged_text):
+        tag, value = match.groups()
+        if not value:
+            continue
+        start = text.find(value, cursor)
+        if start == -1:
+            start = text.find(value)
+            if start == -1:
+                continue
+        else:
+            cursor = start + len(value)
+        spans.append((start, start + len(value), tag))
+    return spans
+
+
+def merge_spans(spans: List[Span]) -> List[Span]:
+    """
+    Sorts spans and drops duplicates and spans overlapping an earlier or longer span.
+
+    Args:
+        spans (List[Span]): The spans to merge, possibly from overlapping chunks.
+
+    Returns:
+        List[Span]: Sorted, non-overlapping spans.
+    """
+    merged: List[Span] = []
+    for start, end, tag in sorted(set(spans), key=lambda span: (span[0], span[0] - span[1])):
+        if merged and start < merged[-1][1]:
+            continue
+        merged.append((start, end, tag))
+    return merged
+
+
+def overlay_spans(base: List[Span], extra: List[Span]) -> List[Span]:
+    """
+    Adds the spans of extra that do not overlap any span of base.
+
+    Args:
+        base (List[Span]): Sorted, non-overlapping spans that take precedence.
+        extra (List[Span]): Spans to add where base has no span.
+
+    Returns:
+        List[Span]: Sorted, non-overlapping spans.
+    """
+    starts = [start for start, _, _ in base]
+    kept = list(base)
+    for start, end, tag in extra:
+        i = bisect_right(starts, start) - 1
+        if i >= 0 and base[i][1] > start:
+            continue
+        if i + 1 < len(base) and base[i + 1][0] < end:
+            continue
+        kept.append((start, end, tag))
+    return merge_spans(kept)
+
+
+def render_tagged_text(text: str, spans: List[Span]) -> str:
+    """
+    Builds tagged text from the original text and non-overlapping spans.
+
+    Args:
+        text (str): The original text.
+        spans (List[Span]): Sorted, non-overlapping spans.
+
+    Returns:
+        str: The text with each span wrapped in <tag>value</tag>.
+    """
+    parts: List[str] = []
+    cursor = 0
+    for start, end, tag in spans:
+        parts.append(text[cursor:start])
+        parts.append(f'<{tag}>{text[start:end]}</{tag}>')
+        cursor = end
+    parts.append(text[cursor:])
+    return ''.join(parts)
+
+
+def identifiers_from_spans(text: str, spans: List[Span]) -> Dict[str, List[str]]:
+    """
+    Collects the unique values of each tag, in order of first occurrence.
+
+    Args:
+        text (str): The original text.
+        spans (List[Span]): The spans found in text.
+
+    Returns:
+        Dict[str, List[str]]: A dictionary mapping entity types to lists of entity values.
+    """
+    identifiers: Dict[str, List[str]] = {}
+    for start, end, tag in spans:
+        values = identifiers.setdefault(tag, [])
+        if text[start:end] not in values:
+            values.append(text[start:end])
+    return identifiers
+
+
+def locate_values(text: str, entities: List[Tuple[str, str]]) -> List[Span]:
+    """
+    Finds every occurrence of the given values in text with a single regex pass.
+
+    Longer values take precedence over values they contain, and values starting or
+    ending with a word character only match on word boundaries.
+
+    Args:
+        text (str): The original text.
+        entities (List[Tuple[str, str]]): (tag, value) pairs; the first tag given for a value wins.
+
+    Returns:
+        List[Span]: Sorted, non-overlapping spans.
+    """
+    tags: Dict[str, str] = {}
+    for tag, value in entities:
+        if value and value.strip():
+            tags.setdefault(value.strip(), tag)
+    if not tags:
+        return []
+    alternatives = []
+    for value in sorted(tags, key=len, reverse=True):
+        prefix = r'(?<!\w)' if re.match(r'\w', value) else ''
+        suffix = r'(?!\w)' if re.search(r'\w$', value) else ''
+        alternatives.append(f'{prefix}{re.escape(value)}{suffix}')
+    pattern = re.compile('|'.join(alternatives))
+    return [(match.start(), match.end(), tags[match.group()]) for match in pattern.finditer(text)]
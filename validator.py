@@ -0,0 +1,100 @@
+"""
+This module contains local, deterministic checks for TransformedData produced by the LLM.
+"""
+
+import re
+from collections import Counter
+from typing import List
+from entities import Identifiers, TransformedData, Defect
+
+identifier_fields = list(Identifiers.__fields__.keys())
+# Identifier field names, also matching escaped underscores as in first\_name
+_tag_names = '|'.join(field.replace('_', r'\\?_') for field in identifier_fields)
+# Matches opening and closing PII tags; other markup such as <br> is part of the text
+tag_pattern = re.compile(rf'<(/?)({_tag_names})>')
+span_pattern = re.compile(rf'<({_tag_names})>(.*?)</\1>', re.DOTALL)
+# Matches any opening tag, to find tags the LLM made up
+markup_pattern = re.compile(r'<([A-Za-z0-9_\\]+)>')
+
+
+def strip_tags(tagged_text: str) -> str:
+    """
+    Removes the PII tags from the tagged text, keeping any other markup.
+
+    Args:
+        tagged_text (str): The text with PII tagged.
+
+    Returns:
+        str: The text with tags removed.
+    """
+    return tag_pattern.sub('', tagged_text)
+
+
+def validate(transformed_data: TransformedData, original_text: str) -> List[Defect]:
+    """
+    Validates TransformedData against the original text and the Identifiers schema.
+
+    Args:
+        transformed_data (TransformedData): The output of the LLM.
+        original_text (str): The text that was tagged.
+
+    Returns:
+        List[Defect]: The defects found, empty if the data is structurally correct.
+    """
+    if transformed_data is None or transformed_data.tagged_text is None:
+        return [Defect(code="missing_tagged_text", message="tagged_text is missing")]
+    tagged_text = transformed_data.tagged_text
+    defects: List[Defect] = []
+
+    for match in markup_pattern.finditer(tagged_text):
+        tag = match.group(1)
+        # markup that is already in the original text is not a tag added by the LLM
+        if tag.replace('\\', '') not in identifier_fields and match.group(0) not in original_text:
+            defects.append(Defect(code="unknown_tag", tag=tag,
+                                  message=f"Tag '{tag}' is not one of {', '.join(identifier_fields)}"))
+
+    depth = 0
+    for match in tag_pattern.finditer(tagged_text):
+        closing, tag = match.groups()
+        if not closing and '\\' in tag:
+            defects.append(Defect(code="escaped_underscore", tag=tag,
+                                  message=f"Tag '{tag}' contains escaped underscores; use '{tag.replace(chr(92), '')}'"))
+        depth += -1 if closing else 1
+        if depth < 0 or depth > 1:
+            defects.append(Defect(code="malformed_tag", tag=tag,
+                                  message=f"Tag '{tag}' at offset {match.start()} is nested or unbalanced"))
+            depth = max(0, min(depth, 1))
+    if depth != 0:
+        defects.append(Defect(code="malformed_tag", message="tagged_text has an unclosed tag"))
+
+    if strip_tags(tagged_text).strip() != original_text.strip():
+        defects.append(Defect(code="text_mismatch",
+                              message="tagged_text with tags removed differs from the original text"))
+
+    tagged_values = Counter((tag, value) for tag, value in span_pattern.findall(tagged_text))
+    identifiers = transformed_data.identifiers.dict() if transformed_data.identifiers else {}
+    listed_values = set()
+    for field, values in identifiers.items():
+        for value in values or []:
+            listed_values.add((field, value))
+            if (field, value) not in tagged_values:
+                defects.append(Defect(code="untagged_value", tag=field, value=value,
+                                      message=f"'{value}' is listed under {field} but not tagged as <{field}>{value}</{field}>"))
+    for tag, value in tagged_values:
+        if tag in identifier_fields and (tag, value) not in listed_values:
+            defects.append(Defect(code="unlisted_value", tag=tag, value=value,
+                                  message=f"<{tag}>{value}</{tag}> is tagged but not listed under identifiers.{tag}"))
+    return defects
+
+
+def format_defects(defects: List[Defect]) -> str:
+    """
+    Formats defects as a bulleted list suitable for repair feedback to the LLM.
+
+    Args:
+        defects (List[Defect]): The defects to format.
+
+    Returns:
+        str: The formatted defects.
+    """
+    return "\n".join(f"- [{defect.code}] {defect.message}" for defect in defects)